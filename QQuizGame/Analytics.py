@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import pickle
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from QQuizGame.EventLog import EventLog
+
+
+class LevelStats:
+    """Aggregates of one level: answers of every player and attempts-to-solve of the solvers"""
+    __slots__ = ('attempts', 'tries', 'solved', 'wrong')
+
+    def __init__(self):
+        self.attempts = 0
+        self.tries = {}
+        self.solved = {}
+        self.wrong = Counter()
+
+    @property
+    def players(self):
+        return len(self.tries)
+
+    @property
+    def solve_rate(self):
+        return len(self.solved) / len(self.tries) if self.tries else 0.0
+
+    @property
+    def median_attempts(self):
+        if not self.solved:
+            return None
+        return float(np.median(np.fromiter(self.solved.values(), dtype=np.int64, count=len(self.solved))))
+
+    def top_wrong(self, count):
+        return self.wrong.most_common(count)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Analytics:
+    """Per-level aggregates of EventLog files, read incrementally from the offsets kept in state_path"""
+    block_size = 1 << 20
+    max_wrong = 1000
+
+    def __init__(self, directory: str, state_path=None, logger=None):
+        self.directory = directory
+        self.state_path = state_path or os.path.join(directory, 'analytics.state')
+        self.logger = logger or logging.getLogger(__name__)
+        self.offsets = {}
+        self.levels = {}
+        self.events = 0
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'rb') as handle:
+                state = pickle.load(handle)
+            self.offsets, self.levels, self.events = state['offsets'], state['levels'], state['events']
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith(EventLog.prefix + '-') and name.endswith(EventLog.suffix))
+
+    def update(self):
+        """Reads the events written since the last run, returns their number"""
+        names = self.files()
+        self.offsets = {name: offset for name, offset in self.offsets.items() if name in names}
+        new_events = 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.getsize(path) <= self.offsets.get(name, 0):
+                continue
+            try:
+                for data, offset in self.__members(path, self.offsets.get(name, 0)):
+                    new_events += self.__aggregate(data)
+                    self.offsets[name] = offset
+            except (OSError, zlib.error) as e:
+                self.logger.warning('%s is read up to %d: %s', name, self.offsets.get(name, 0), e)
+        self.events += new_events
+        self.save()
+        return new_events
+
+    def save(self):
+        for stats in self.levels.values():
+            if len(stats.wrong) > self.max_wrong:
+                stats.wrong = Counter(dict(stats.wrong.most_common(self.max_wrong)))
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump({'offsets': self.offsets, 'levels': self.levels, 'events': self.events}, handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.state_path)
+
+    def games(self):
+        return sorted({game for game, _ in self.levels})
+
+    def counts(self, game, level_count):
+        """Arrays of players who tried and solved every level of a game"""
+        players = np.zeros(level_count, dtype=np.int64)
+        solved = np.zeros(level_count, dtype=np.int64)
+        for (stats_game, level), stats in self.levels.items():
+            if stats_game == game and 0 <= level < level_count:
+                players[level] = stats.players
+                solved[level] = len(stats.solved)
+        return players, solved
+
+    def report(self, top=5):
+        """{game: [(level, attempts, players, solve rate, median attempts-to-solve, top wrong answers)]}"""
+        report = {}
+        for (game, level), stats in sorted(self.levels.items()):
+            report.setdefault(game, []).append((level, stats.attempts, stats.players, stats.solve_rate,
+                                                stats.median_attempts, stats.top_wrong(top)))
+        return report
+
+    def __members(self, path, offset):
+        """(decompressed member, offset after it) for every complete gzip member starting from offset"""
+        with open(path, 'rb') as handle:
+            handle.seek(offset)
+            decompressor = zlib.decompressobj(wbits=31)
+            chunks = []
+            while True:
+                block = handle.read(self.block_size)
+                if not block:
+                    return
+                while block:
+                    chunks.append(decompressor.decompress(block))
+                    if not decompressor.eof:
+                        break
+                    block = decompressor.unused_data
+                    yield b''.join(chunks), handle.tell() - len(block)
+                    decompressor = zlib.decompressobj(wbits=31)
+                    chunks = []
+
+    def __aggregate(self, data):
+        events = [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+        if not events:
+            return 0
+        keys = {}
+        key_ids = np.fromiter((keys.setdefault((event['game'], event['level']), len(keys)) for event in events),
+                              dtype=np.int64, count=len(events))
+        users = np.fromiter((event['user'] for event in events), dtype=np.int64, count=len(events))
+        correct = np.fromiter((event['outcome'] == 'correct' for event in events), dtype=bool, count=len(events))
+
+        # группы (уровень, игрок) в порядке ответов внутри группы
+        order = np.lexsort((np.arange(len(events)), users, key_ids))
+        key_ids, users, correct = key_ids[order], users[order], correct[order]
+        starts = np.ones(len(events), dtype=bool)
+        starts[1:] = (key_ids[1:] != key_ids[:-1]) | (users[1:] != users[:-1])
+        start_index = np.flatnonzero(starts)
+        group = np.cumsum(starts) - 1
+        position = np.arange(len(events)) - start_index[group] + 1
+        counts = np.bincount(group)
+        first_correct = np.full(len(start_index), len(events) + 1, dtype=np.int64)
+        np.minimum.at(first_correct, group[correct], position[correct])
+        first_correct[first_correct > len(events)] = 0
+
+        names = list(keys)
+        level_stats = [self.levels.setdefault(key, LevelStats()) for key in names]
+        for stats, attempts in zip(level_stats, np.bincount(key_ids, minlength=len(names)).tolist()):
+            stats.attempts += attempts
+        for key_id, user, count, solved_at in zip(key_ids[start_index].tolist(), users[start_index].tolist(),
+                                                  counts.tolist(), first_correct.tolist()):
+            stats = level_stats[key_id]
+            before = stats.tries.get(user, 0)
+            stats.tries[user] = before + count
+            if solved_at and user not in stats.solved:
+                stats.solved[user] = before + solved_at
+        for event in events:
+            if event['outcome'] != 'correct':
+                self.levels[(event['game'], event['level'])].wrong[event['answer']] += 1
+        return len(events)
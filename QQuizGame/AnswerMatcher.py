@@ -0,0 +1,124 @@
+from collections import Counter
+from itertools import combinations
+
+from QQuizGame.Types import AnswerMatch
+
+MAX_DISTANCE = 2
+
+def normalize(text: str):
+    return text.lower().replace('ё', 'е').strip()
+
+
+def _deletes(word, distance):
+    variants = {word}
+    for n in range(1, min(distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), n):
+            skip = set(positions)
+            variants.add(''.join(char for i, char in enumerate(word) if i not in skip))
+    return variants
+
+
+def edit_distance(first, second, limit):
+    """Optimal string alignment distance, or limit + 1 as soon as it is known to exceed limit.
+    Only the diagonal band of width 2 * limit + 1 is computed."""
+    over = limit + 1
+    if abs(len(first) - len(second)) > limit:
+        return over
+    previous2 = None
+    previous = [min(j, over) for j in range(len(second) + 1)]
+    for i in range(1, len(first) + 1):
+        current = [over] * (len(second) + 1)
+        current[0] = min(i, over)
+        low, high = max(1, i - limit), min(len(second), i + limit)
+        for j in range(low, high + 1):
+            cost = first[i - 1] != second[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = min(value, over)
+        if min(current[low - 1:high + 1]) > limit:
+            return over
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class AnswerMatcher:
+    """Answers and guesses of one level compiled for constant time lookup, typos are found through a
+    deletion neighbourhood table (as in SymSpell) or, for long inputs, among answers of a close length"""
+    max_deletes_length = 16
+
+    __slots__ = ('answers', 'guesses', 'distance', 'neighbours', 'close_answers', 'letters', 'min_length',
+                 'max_length', 'alphabet')
+
+    def __init__(self, answers, guesses, distance=0):
+        self.answers = frozenset(answer for answer in answers if answer)
+        self.guesses = {guess: reply for guess, reply in guesses if guess}
+        self.distance = distance = min(distance, MAX_DISTANCE)
+        self.neighbours = {}
+        self.letters = {}
+        # короткие ответы не считаются близкими: в них пара опечаток меняет слово целиком
+        self.close_answers = {}
+        for answer in self.answers:
+            if distance > 0 and len(answer) >= 4 * distance:
+                self.close_answers.setdefault(len(answer), []).append(answer)
+        for answers in self.close_answers.values():
+            for answer in answers:
+                if len(answer) > self.max_deletes_length - distance:
+                    self.letters[answer] = tuple(Counter(answer).items())
+                if len(answer) > self.max_deletes_length + distance:
+                    continue
+                for variant in _deletes(answer, distance):
+                    self.neighbours.setdefault(variant, set()).add(answer)
+
+        lengths = [len(answer) for answer in self.answers] + [len(guess) for guess in self.guesses]
+        self.min_length = min(lengths, default=1) - (distance if self.close_answers else 0)
+        self.max_length = max(lengths, default=0) + (distance if self.close_answers else 0)
+        self.alphabet = frozenset(''.join(self.answers) + ''.join(self.guesses))
+
+    def may_match(self, text: str):
+        if not self.min_length <= len(text.strip()) <= self.max_length:
+            return False
+        unknown = set(normalize(text)).difference(self.alphabet)
+        return len(unknown) <= (self.distance if self.close_answers else 0)
+
+    def match(self, text: str):
+        text = normalize(text)
+        if text in self.answers:
+            return AnswerMatch.EXACT, None
+        reply = self.guesses.get(text)
+        if reply is not None:
+            return AnswerMatch.GUESS, reply
+        if self.close_answers and self.__is_close(text):
+            return AnswerMatch.CLOSE, None
+        return AnswerMatch.MISS, None
+
+    def __is_close(self, text):
+        if not self.min_length <= len(text) <= self.max_length:
+            return False
+        if len(text) > self.max_deletes_length:
+            return self.__is_close_long(text)
+        checked = set()
+        for variant in _deletes(text, self.distance):
+            for answer in self.neighbours.get(variant, ()):
+                if answer in checked:
+                    continue
+                checked.add(answer)
+                if edit_distance(text, answer, self.distance) <= self.distance:
+                    return True
+        return False
+
+    def __is_close_long(self, text):
+        # число удалений длинного текста растёт как len ** distance, поэтому ответы близкой длины сравниваются
+        # напрямую, а разница в количестве букв (не больше расстояния) отсеивает почти все из них без матрицы
+        counts = Counter(text)
+        for length in range(len(text) - self.distance, len(text) + self.distance + 1):
+            for answer in self.close_answers.get(length, ()):
+                missing = 0
+                for char, count in self.letters[answer]:
+                    if count > counts[char]:
+                        missing += count - counts[char]
+                if max(missing, missing + len(text) - length) > self.distance:
+                    continue
+                if edit_distance(text, answer, self.distance) <= self.distance:
+                    return True
+        return False
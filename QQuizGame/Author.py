@@ -2,9 +2,13 @@ import logging
 from collections import defaultdict
 
 import yaml
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, PicklePersistence, CallbackQueryHandler
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, PicklePersistence
 
+from QQuizGame.CallbackRouter import CallbackRouter
+from QQuizGame.GameCatalog import GameCatalog
 from QQuizGame.ReadWrite import ReadWrite
+from QQuizGame.SQLitePersistence import SQLitePersistence
+from QQuizGame.Webhook import WebhookConfig, WebhookServer
 from QQuizGame.logging_setup import setup_logger
 
 
@@ -15,6 +19,15 @@ class AuthorConfig:
     token = ""
     save_media = True
     user_db_path = ""
+    persistence = "pickle"
+    sqlite_db_path = ""
+    persistence_flush_interval = 5.0
+    mode = "polling"
+    log_max_bytes = 10 * 1024 * 1024
+    log_backup_count = 5
+    log_rotate_when = None
+    log_compress = True
+    log_levels = {}
 
     def __init__(self, config):
         with open(config, 'r') as handle:
@@ -26,6 +39,17 @@ class AuthorConfig:
             self.token = config['token']  # TODO: add encryption
             self.save_media = bool(int(config['save_media']))
             self.user_db_path = config['user_db_path']
+            self.persistence = config.get('persistence', self.persistence)
+            self.sqlite_db_path = config.get('sqlite_db_path', self.user_db_path + '.sqlite')
+            self.persistence_flush_interval = float(config.get('persistence_flush_interval',
+                                                               self.persistence_flush_interval))
+            self.mode = config.get('mode', self.mode)
+            self.log_max_bytes = int(config.get('log_max_bytes', self.log_max_bytes))
+            self.log_backup_count = int(config.get('log_backup_count', self.log_backup_count))
+            self.log_rotate_when = config.get('log_rotate_when') or self.log_rotate_when
+            self.log_compress = bool(int(config.get('log_compress', self.log_compress)))
+            self.log_levels = config.get('log_levels') or self.log_levels
+            self.webhook = WebhookConfig(config)
 
 
 class Author:
@@ -34,21 +58,48 @@ class Author:
     def __init__(self, config_path: str):
         self.config = AuthorConfig(config_path)
 
-        puzzles_db = PicklePersistence(filename=self.config.user_db_path)
+        if self.config.persistence == 'sqlite':
+            puzzles_db = SQLitePersistence(self.config.sqlite_db_path,
+                                           self.config.persistence_flush_interval,
+                                           migrate_from=self.config.user_db_path)
+        else:
+            puzzles_db = PicklePersistence(filename=self.config.user_db_path)
         self.updater = Updater(self.config.token, use_context=True, persistence=puzzles_db)
         self.init_dispatcher(self.updater.dispatcher)
 
         self.logger = setup_logger(__name__,
                                    self.config.logger_path,
-                                   logging.INFO)
+                                   logging.INFO,
+                                   max_bytes=self.config.log_max_bytes,
+                                   backup_count=self.config.log_backup_count,
+                                   when=self.config.log_rotate_when,
+                                   compress=self.config.log_compress,
+                                   levels=self.config.log_levels)
+        self.webhook = None
+
+    def start(self, demon=False):
+        if self.config.mode == 'webhook':
+            self.start_webhook(demon)
+        else:
+            self.start_polling(demon)
 
     def start_polling(self, demon=False):
         self.updater.start_polling()
         if not demon:
             self.updater.idle()
 
+    def start_webhook(self, demon=False):
+        self.webhook = WebhookServer(self.updater, self.config.webhook, self.logger)
+        self.webhook.start()
+        if not demon:
+            self.webhook.idle()
+
     def stop_polling(self):
+        if self.webhook:
+            self.webhook.stop()
         self.updater.stop()
+        self.updater.dispatcher.update_persistence()
+        self.updater.persistence.flush()
 
     def __get_chat_meta(self, update, context):
         if update.effective_message.chat.type == 'private':
@@ -264,13 +315,15 @@ class Author:
 
     def __set_game_folder(self, update, context):
         update.effective_message.reply_text(text='Choose game',
-                                            reply_markup=ReadWrite.parse_game_folders_markup(self.config.working_path,
-                                                                                             True))
+                                            reply_markup=GameCatalog.get(self.config.working_path).markup(True))
 
     def __game_folder_button(self, update, context):
         query = update.callback_query
         metadata = self.__get_chat_meta(update, context)
-        button = query.data.split('-')[-1]
+        button = context.args[0]
+        if button not in GameCatalog.get(self.config.working_path):
+            query.answer(text=CallbackRouter.stale_text)
+            return
         metadata['puzzle_folder'] = button
         query.edit_message_text(text='Writing to ' + button)
 
@@ -303,5 +356,7 @@ class Author:
         dispatcher.add_handler(CommandHandler("getgame", self.__get_game_folder))
         dispatcher.add_handler(CommandHandler('help', self.__help))
 
-        dispatcher.add_handler(CallbackQueryHandler(self.__game_folder_button, pattern='^puzzname'))
+        router = CallbackRouter()
+        router.add('puzzname', self.__game_folder_button)
+        dispatcher.add_handler(router.handler())
         dispatcher.add_handler(MessageHandler(~Filters.command, self.__data_getter))
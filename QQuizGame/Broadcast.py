@@ -0,0 +1,163 @@
+import logging
+import queue
+import threading
+import time
+
+from telegram.error import Unauthorized, ChatMigrated, RetryAfter
+
+
+class TokenBucket:
+    """Thread-safe token bucket. acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class RateLimitedBot:
+    """Bot proxy whose send* calls wait for the rate buckets and retry on RetryAfter"""
+    max_retries = 3
+
+    def __init__(self, bot, global_bucket, group_rate):
+        self._bot = bot
+        self._global_bucket = global_bucket
+        self._group_rate = group_rate
+        self._chat_buckets = {}
+        self._lock = threading.Lock()
+
+    def __chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self._group_rate)
+            return bucket
+
+    def __getattr__(self, name):
+        method = getattr(self._bot, name)
+        if not name.startswith('send'):
+            return method
+
+        def limited(chat_id, *args, **kwargs):
+            for attempt in range(self.max_retries + 1):
+                if isinstance(chat_id, int) and chat_id < 0:
+                    self.__chat_bucket(chat_id).acquire()
+                self._global_bucket.acquire()
+                try:
+                    return method(chat_id, *args, **kwargs)
+                except RetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self._global_bucket.pause(float(e.retry_after))
+                    for item in list(args) + list(kwargs.values()):
+                        if hasattr(item, 'seek'):
+                            item.seek(0)
+
+        return limited
+
+
+class BroadcastReport:
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.results = {}
+        self.blocked = []
+        self.migrated = {}
+        self.failed = {}
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.sent + len(self.blocked) + len(self.failed)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return "%d/%d done in %.1fs (%.1f chats/s): %d sent, %d blocked, %d migrated, %d failed" % (
+            self.done, self.total, self.elapsed, self.rate,
+            self.sent, len(self.blocked), len(self.migrated), len(self.failed))
+
+
+class Broadcast:
+    """Sends one job to many chats with a pool of workers at the bot API limits"""
+
+    def __init__(self, bot, workers=8, rate=30.0, group_rate=1.0, logger=None, progress_every=1000):
+        self.bot = RateLimitedBot(bot, TokenBucket(rate), group_rate)
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.progress_every = progress_every
+
+    def run(self, chat_ids, job):
+        chat_ids = list(chat_ids)
+        report = BroadcastReport(len(chat_ids))
+        tasks = queue.Queue()
+        for chat_id in chat_ids:
+            tasks.put(chat_id)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    chat_id = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    result = job(self.bot, chat_id)
+                except Unauthorized:
+                    with lock:
+                        report.blocked.append(chat_id)
+                except ChatMigrated as e:
+                    with lock:
+                        report.migrated[chat_id] = e.new_chat_id
+                    tasks.put(e.new_chat_id)
+                    continue
+                except Exception as e:
+                    # любая ошибка задания (например, пропавший файл) не должна убивать воркер
+                    with lock:
+                        report.failed[chat_id] = e
+                    self.logger.warning('Broadcast to %s failed: %r', chat_id, e)
+                else:
+                    with lock:
+                        report.sent += 1
+                        report.results[chat_id] = result
+                with lock:
+                    progress = report.done % self.progress_every == 0
+                if progress:
+                    self.logger.info('Broadcast progress: %s', report)
+
+        threads = [threading.Thread(target=worker, name='Broadcast-%d' % i, daemon=True)
+                   for i in range(min(self.workers, max(len(chat_ids), 1)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.finished = time.monotonic()
+        self.logger.info('Broadcast finished: %s', report)
+        return report
@@ -0,0 +1,94 @@
+import json
+import mmap
+import os
+import struct
+
+from QQuizGame import LevelFormat
+from QQuizGame.Shared import Registry
+
+BUNDLE_NAME = 'levels.qqb'
+
+
+class Bundle:
+    """Whole game packed in one file and read through mmap"""
+    MAGIC = b'QQGB'
+    VERSION = 2
+    # magic, version, flags, level count, catalog offset and length; then (offset, length) of every level record,
+    # the records, media blobs and the json catalog {"levels": [...], "media": {"level/file": [offset, length]}}
+    HEADER = struct.Struct('<4sHHIQI')
+    ENTRY = struct.Struct('<QI')
+
+    _bundles = Registry()
+
+    def __init__(self, path: str, mtime):
+        self.path = path
+        self.mtime = mtime
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._count, catalog_offset, catalog_length = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(path + " is not a game bundle of version " + str(self.VERSION))
+        catalog = json.loads(self._map[catalog_offset:catalog_offset + catalog_length].decode('utf-8'))
+        self.levels = catalog['levels']
+        self.media = catalog['media']
+        self._positions = {level: i for i, level in enumerate(self.levels)}
+
+    @classmethod
+    def get(cls, working_dir: str):
+        """Opened bundle of the game or None if the game is stored as folders"""
+        path = os.path.join(working_dir, BUNDLE_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            cls._bundles.pop(path, None)
+            return None
+        return cls._bundles.setup(path, lambda: cls(path, mtime), lambda bundle: bundle.mtime != mtime)
+
+    @classmethod
+    def find(cls, working_dir: str):
+        """Already opened bundle without touching the disk"""
+        return cls._bundles.get(os.path.join(working_dir, BUNDLE_NAME))
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def read_level(self, name: str):
+        offset, length = self.ENTRY.unpack_from(self._map, self.HEADER.size + self._positions[name] * self.ENTRY.size)
+        return LevelFormat.decode(self._map[offset:offset + length])
+
+    def media_bytes(self, name: str, file_name: str):
+        blob = self.media.get(name + '/' + file_name)
+        if blob is None:
+            return None
+        offset, length = blob
+        return self._map[offset:offset + length]
+
+    @classmethod
+    def write(cls, path: str, levels):
+        """Pack levels, an iterable of (name, question, answers, {file name: media path}), into a bundle"""
+        levels = list(levels)
+        names = [level[0] for level in levels]
+        media = {}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            handle.write(b'\0' * (cls.HEADER.size + cls.ENTRY.size * len(levels)))
+            table = []
+            for name, question, answers, _ in levels:
+                record = LevelFormat.encode(question, answers)
+                table.append((handle.tell(), len(record)))
+                handle.write(record)
+            for name, _, _, files in levels:
+                for file_name, file_path in files.items():
+                    with open(file_path, 'rb') as media_handle:
+                        blob = media_handle.read()
+                    media[name + '/' + file_name] = (handle.tell(), len(blob))
+                    handle.write(blob)
+            catalog = json.dumps({'levels': names, 'media': media}, ensure_ascii=False).encode('utf-8')
+            catalog_offset = handle.tell()
+            handle.write(catalog)
+
+            handle.seek(0)
+            handle.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(levels), catalog_offset, len(catalog)))
+            for entry in table:
+                handle.write(cls.ENTRY.pack(*entry))
+        os.replace(tmp_path, path)
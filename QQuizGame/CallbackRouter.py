@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+from telegram.ext import CallbackQueryHandler
+
+
+class CallbackRouter:
+    """One CallbackQueryHandler for all inline buttons, "action-args" data is routed through a dict"""
+    MAX_DATA = 64
+    PACKED = '~'
+    max_payloads = 10000
+    stale_text = 'Меню устарело, вызови команду ещё раз'
+
+    _payloads = OrderedDict()
+    _pinned = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self._routes = {}
+
+    def add(self, action: str, callback):
+        self._routes[action] = callback
+
+    def handler(self):
+        return CallbackQueryHandler(self.handle)
+
+    @classmethod
+    def pack(cls, action: str, args='', pinned=False):
+        data = action + '-' + args if args else action
+        if len(data.encode('utf-8')) <= cls.MAX_DATA:
+            return data
+        key = cls.PACKED + base64.urlsafe_b64encode(hashlib.sha1(data.encode('utf-8')).digest()[:12]).decode()
+        if pinned:
+            with cls._lock:
+                cls._pinned[key] = data
+            return key
+        with cls._lock:
+            cls._payloads[key] = data
+            cls._payloads.move_to_end(key)
+            while len(cls._payloads) > cls.max_payloads:
+                cls._payloads.popitem(last=False)
+        return key
+
+    @classmethod
+    def unpack(cls, data: str):
+        if data.startswith(cls.PACKED):
+            return cls._pinned.get(data) or cls._payloads.get(data)
+        return data
+
+    @staticmethod
+    def parse(data: str):
+        action, _, args = data.partition('-')
+        return action, args
+
+    def handle(self, update, context):
+        query = update.callback_query
+        data = self.unpack(query.data or '')
+        callback = None
+        if data is not None:
+            action, args = self.parse(data)
+            callback = self._routes.get(action)
+        if callback is None:
+            query.answer(text=self.stale_text)
+            return
+        context.args = [args] if args else []
+        return callback(update, context)
@@ -0,0 +1,58 @@
+import logging
+import queue
+import threading
+
+from telegram import Update
+
+
+class ChatExecutor:
+    """Runs updates on worker threads sharded by chat id, updates of a chat keep their order"""
+
+    def __init__(self, workers=8, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._threads = [threading.Thread(target=self.__run, args=(tasks,), name='ChatWorker-%d' % i, daemon=True)
+                         for i, tasks in enumerate(self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def install(self, dispatcher):
+        process_update = dispatcher.process_update
+        # object.__setattr__ обходит предупреждение PTB о собственных атрибутах диспетчера
+        object.__setattr__(dispatcher, 'process_update', lambda update: self.submit(update, process_update))
+
+    @staticmethod
+    def chat_key(update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return 0
+
+    def submit(self, update, process_update):
+        if not isinstance(update, Update):
+            # ошибки и прочие служебные объекты диспетчера обрабатываем на месте
+            return process_update(update)
+        self._queues[hash(self.chat_key(update)) % len(self._queues)].put((process_update, update))
+
+    @property
+    def pending(self):
+        return sum(tasks.qsize() for tasks in self._queues)
+
+    def stop(self):
+        """Handles the queued updates and stops the workers"""
+        for tasks in self._queues:
+            tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __run(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            process_update, update = task
+            try:
+                process_update(update)
+            except Exception:
+                self.logger.exception('Update %s was not processed', update.update_id)
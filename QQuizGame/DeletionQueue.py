@@ -0,0 +1,88 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from QQuizGame.Broadcast import TokenBucket
+
+
+class DeletionQueue:
+    """Deletes messages on a background thread, lower priority values first"""
+    batch_size = 100
+    # no spoiler чистка не должна ждать за сотнями тысяч удалений загадки дня
+    URGENT = 0
+    BULK = 1
+
+    def __init__(self, bot, rate=20.0, logger=None):
+        self.bot = bot
+        self.logger = logger or logging.getLogger(__name__)
+        self.deleted = 0
+        self.dropped = 0
+        self._bucket = TokenBucket(rate)
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._deadline = None
+        self._thread = threading.Thread(target=self.__run, name='DeletionQueue', daemon=True)
+        self._thread.start()
+
+    def put(self, messages, priority=URGENT):
+        chats = OrderedDict()
+        for message in messages:
+            if not isinstance(message, tuple):
+                message = message.chat_id, message.message_id
+            chats.setdefault(message[0], []).append(message[1])
+        # без bulk удаления по одному сообщению на задачу, чтобы срочные не ждали целую пачку
+        size = self.batch_size if hasattr(self.bot, 'delete_messages') else 1
+        for chat_id, message_ids in chats.items():
+            for i in range(0, len(message_ids), size):
+                self._queue.put((priority, next(self._order), (chat_id, message_ids[i:i + size])))
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=5.0):
+        """Deletes what it can in timeout seconds, the rest is dropped"""
+        self._deadline = time.monotonic() + timeout
+        self._queue.put((float('inf'), next(self._order), None))
+        self._thread.join(timeout + 1)
+
+    def __run(self):
+        while True:
+            task = self._queue.get()[2]
+            if task is None:
+                return
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                self.__drop_rest(task)
+                return
+            self.__delete(*task)
+
+    def __drop_rest(self, task):
+        count = 0
+        while task is not None:
+            count += len(task[1])
+            task = self._queue.get()[2]
+        self.dropped += count
+        self.logger.warning('%d messages are left undeleted on stop', count)
+
+    def __delete(self, chat_id, message_ids):
+        # воркер один на весь бот, поэтому любая ошибка (не только TelegramError) теряет только эти сообщения
+        if hasattr(self.bot, 'delete_messages'):
+            self._bucket.acquire()
+            try:
+                self.bot.delete_messages(chat_id, message_ids)
+                self.deleted += len(message_ids)
+            except Exception as e:
+                self.dropped += len(message_ids)
+                self.logger.warning('Messages %s in chat %s not deleted: %r', message_ids, chat_id, e)
+            return
+        for message_id in message_ids:
+            self._bucket.acquire()
+            try:
+                self.bot.delete_message(chat_id, message_id)
+                self.deleted += 1
+            except Exception as e:
+                self.dropped += 1
+                self.logger.warning('Message %s in chat %s not deleted: %r', message_id, chat_id, e)
@@ -0,0 +1,219 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from QQuizGame.LevelIndex import LevelIndex
+from QQuizGame.Shared import Shared
+
+DIFFICULTY_NAME = 'difficulty.npz'
+
+
+class LevelSampler:
+    """Draws levels by weight and removes them in O(log n) with a Fenwick tree, solved is the bitmap it reflects"""
+    __slots__ = ('version', 'solved', 'weights', 'tree', 'total')
+
+    def __init__(self, weights, version=None, solved=b''):
+        weights = np.array(weights, dtype=np.float64)
+        prefix = np.concatenate(([0.0], np.cumsum(weights)))
+        index = np.arange(1, len(weights) + 1)
+        self.tree = np.zeros(len(weights) + 1)
+        self.tree[1:] = prefix[index] - prefix[index - (index & -index)]
+        self.version = version
+        self.solved = solved
+        self.weights = weights
+        self.total = float(prefix[-1])
+
+    def __len__(self):
+        return len(self.weights)
+
+    @property
+    def nbytes(self):
+        return self.weights.nbytes + self.tree.nbytes
+
+    def remove(self, level: int):
+        weight = float(self.weights[level]) if 0 <= level < len(self.weights) else 0.0
+        if not weight:
+            return
+        self.weights[level] = 0.0
+        self.total -= weight
+        tree = self.tree
+        level += 1
+        while level < len(tree):
+            tree[level] -= weight
+            level += level & -level
+
+    def draw(self, rand=random.random):
+        """Level drawn by weight or None if every level is removed"""
+        if self.total <= 0:
+            return None
+        value = rand() * self.total
+        tree = self.tree
+        position = 0
+        step = 1 << (len(self.weights).bit_length() - 1)
+        while step:
+            if position + step < len(tree) and tree[position + step] <= value:
+                position += step
+                value -= tree[position]
+            step >>= 1
+        if position < len(self.weights) and self.weights[position] > 0:
+            return position
+        # value попало на округлении в хвост или в удалённый уровень
+        left = np.flatnonzero(self.weights)
+        return int(left[-1]) if len(left) else None
+
+
+class UniformSampler:
+    """Draws levels uniformly and removes them in O(1): free[:count] are the levels left, positions their places"""
+    __slots__ = ('version', 'solved', 'free', 'positions', 'count')
+
+    def __init__(self, levels, size: int, version=None, solved=b''):
+        self.free = np.array(levels, dtype=np.int32)
+        self.positions = np.full(size, -1, dtype=np.int32)
+        self.positions[self.free] = np.arange(len(self.free), dtype=np.int32)
+        self.count = len(self.free)
+        self.version = version
+        self.solved = solved
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.free.nbytes + self.positions.nbytes
+
+    def remove(self, level: int):
+        position = int(self.positions[level]) if 0 <= level < len(self.positions) else -1
+        if position < 0:
+            return
+        self.count -= 1
+        last = int(self.free[self.count])
+        self.free[position] = last
+        self.positions[last] = position
+        self.positions[level] = -1
+
+    def draw(self, rand=random.random):
+        """Random level or None if every level is removed"""
+        if not self.count:
+            return None
+        return int(self.free[int(rand() * self.count)])
+
+
+class Difficulty(Shared):
+    """Beta posterior solve rate of the levels of a game from the player counts in difficulty.npz.
+    Counts are stored by level name, but events only carry level numbers, so names are those at store time."""
+    prior_strength = 2.0
+    sampler_budget = 32 * 1024 * 1024  # байт на LRU сэмплеров непройденных уровней всех сессий процесса
+
+    _samplers = OrderedDict()
+    _samplers_bytes = 0
+    _samplers_lock = threading.Lock()
+
+    def __init__(self, working_dir: str):
+        self.working_dir = working_dir
+        self.path = os.path.join(working_dir, DIFFICULTY_NAME)
+        self.rates = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.has_stats = False
+
+    @property
+    def version(self):
+        return self._version
+
+    def refresh(self):
+        index = LevelIndex.get(self.working_dir)
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        self._reload((mtime, index.version), lambda: self.__load(index, mtime))
+
+    def __load(self, index, mtime):
+        players = np.zeros(len(index))
+        solved = np.zeros(len(index))
+        if mtime is not None:
+            with np.load(self.path) as stored:
+                for name, level_players, level_solved in zip(stored['levels'].tolist(),
+                                                              stored['players'].tolist(),
+                                                              stored['solved'].tolist()):
+                    if name in index:
+                        players[index.index(name)] = level_players
+                        solved[index.index(name)] = level_solved
+        self.rates = self.estimate(players, solved, self.prior_strength)
+        # "The End" не разыгрывается
+        self.weights = np.where([parts[-1] == 'The End' for parts in index.parts], 0.0, self.rates)
+        self.has_stats = mtime is not None
+
+    @staticmethod
+    def estimate(players, solved, prior_strength=2.0):
+        """Posterior mean solve rate of every level for arrays of players who tried and solved it"""
+        players = np.asarray(players, dtype=np.float64)
+        solved = np.minimum(np.asarray(solved, dtype=np.float64), players)
+        mean = solved.sum() / players.sum() if players.sum() else 0.5
+        mean = min(max(mean, 0.01), 0.99)
+        return (prior_strength * mean + solved) / (prior_strength + players)
+
+    @staticmethod
+    def store(working_dir: str, levels, players, solved):
+        """Writes counts of players who tried and solved the levels next to the game"""
+        path = os.path.join(working_dir, DIFFICULTY_NAME)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, levels=np.array(levels, dtype=str), players=np.asarray(players, dtype=np.int64),
+                 solved=np.asarray(solved, dtype=np.int64))
+        os.replace(tmp_path, path)
+
+    def sampler(self, session):
+        """Sampler of the levels not solved in the session"""
+        # сэмплер задаётся только весами и битовой маской, поэтому и сессия, получившая id удалённой,
+        # получит верный сэмплер: маска либо дополняет прежнюю, либо сэмплер строится заново
+        key = (self.path, id(session))
+        solved = bytes(session.solved)
+        with self._samplers_lock:
+            sampler = self._samplers.get(key)
+            if sampler is not None:
+                self._samplers.move_to_end(key)
+        if sampler is not None and sampler.version == self._version:
+            added = self.__added(sampler.solved, solved)
+            if added is not None:
+                for level in added:
+                    sampler.remove(level)
+                sampler.solved = solved
+                return sampler
+        weights = np.where(session.solved_mask(len(self.weights)), 0.0, self.weights)
+        if self.has_stats:
+            sampler = LevelSampler(weights, self._version, solved)
+        else:
+            sampler = UniformSampler(np.flatnonzero(weights), len(weights), self._version, solved)
+        self.__keep(key, sampler)
+        return sampler
+
+    @staticmethod
+    def __added(old, new):
+        """Levels solved in new but not in old or None if some level of old is not solved in new"""
+        if old == new:
+            return ()
+        size = max(len(old), len(new))
+        old = np.frombuffer(old.ljust(size, b'\0'), dtype=np.uint8)
+        new = np.frombuffer(new.ljust(size, b'\0'), dtype=np.uint8)
+        if (old & ~new).any():
+            return None
+        added = new & ~old
+        return [byte * 8 + bit for byte in np.flatnonzero(added).tolist() for bit in range(8) if added[byte] >> bit & 1]
+
+    @classmethod
+    def __keep(cls, key, sampler):
+        with cls._samplers_lock:
+            previous = cls._samplers.pop(key, None)
+            if previous is not None:
+                cls._samplers_bytes -= previous.nbytes
+            cls._samplers[key] = sampler
+            cls._samplers_bytes += sampler.nbytes
+            while cls._samplers_bytes > cls.sampler_budget and len(cls._samplers) > 1:
+                _, evicted = cls._samplers.popitem(last=False)
+                cls._samplers_bytes -= evicted.nbytes
+
+    def draw(self, session):
+        """Random unsolved level or None if nothing is left"""
+        return self.sampler(session).draw()
@@ -0,0 +1,111 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+
+class EventLog:
+    """Append-only gzip jsonl log of answer events written by a background thread"""
+    prefix = 'answers'
+    suffix = '.jsonl.gz'
+
+    def __init__(self, directory: str, max_bytes=16 * 1024 * 1024, keep=0, flush_interval=1.0, batch_size=1000,
+                 max_queue=100000, logger=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.peak = 0
+        self._queue = queue.Queue(max_queue)
+        self._path = None
+        self._stamp = None
+        self._number = 0
+        self._stop = object()
+        self._thread = threading.Thread(target=self.__run, name='EventLog', daemon=True)
+        self._thread.start()
+
+    def push(self, chat_id, user_id, game, level, answer, outcome):
+        event = {'ts': round(time.time(), 3), 'chat': chat_id, 'user': user_id, 'game': game, 'level': level,
+                 'answer': answer, 'outcome': outcome}
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.queued += 1
+        self.peak = max(self.peak, self._queue.qsize())
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {'queued': self.queued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'pending': self.pending,
+                'peak': self.peak,
+                'batches': self.batches}
+
+    def stop(self):
+        self._queue.put(self._stop)
+        self._thread.join()
+
+    def files(self):
+        """Log files from the oldest to the newest"""
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(self.prefix + '-') and name.endswith(self.suffix))
+
+    def __run(self):
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is self._stop:
+                    stopped = True
+                    break
+                batch.append(event)
+            if batch:
+                try:
+                    self.__write(batch)
+                except OSError as e:
+                    self.dropped += len(batch)
+                    self.logger.warning('%d answer events are lost: %s', len(batch), e)
+
+    def __write(self, batch):
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in batch).encode('utf-8')
+        if self._path is None or not os.path.exists(self._path) or os.path.getsize(self._path) >= self.max_bytes:
+            self.__rotate()
+        with open(self._path, 'ab') as handle:
+            handle.write(gzip.compress(data))
+        self.written += len(batch)
+        self.batches += 1
+
+    def __rotate(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        number = self._number + 1 if stamp == self._stamp else 0
+        path = os.path.join(self.directory, '%s-%s-%03d%s' % (self.prefix, stamp, number, self.suffix))
+        while os.path.exists(path):
+            number += 1
+            path = os.path.join(self.directory, '%s-%s-%03d%s' % (self.prefix, stamp, number, self.suffix))
+        self._path, self._stamp, self._number = path, stamp, number
+        if self.keep:
+            files = self.files()
+            for old in files[:max(len(files) + 1 - self.keep, 0)]:
+                os.remove(old)
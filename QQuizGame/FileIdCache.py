@@ -0,0 +1,72 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+class FileIdCache:
+    """Persistent map (bot, media path, content hash) -> telegram file_id of the first upload"""
+    _ids = {}
+    _hashes = {}
+    _connection = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, path: str):
+        with cls._lock:
+            cls._connection = sqlite3.connect(path, check_same_thread=False)
+            with cls._connection:
+                cls._connection.execute('CREATE TABLE IF NOT EXISTS file_ids (bot TEXT, path TEXT, hash TEXT, '
+                                        'file_id TEXT, PRIMARY KEY (bot, path, hash))')
+            cls._ids = {(bot, path, content_hash): file_id for bot, path, content_hash, file_id in
+                        cls._connection.execute('SELECT bot, path, hash, file_id FROM file_ids')}
+
+    @staticmethod
+    def bot_key(bot):
+        return str(bot.token).split(':')[0]
+
+    @classmethod
+    def file_hash(cls, path: str):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        content_hash = cls._hashes.get(key)
+        if content_hash is None:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1 << 20), b''):
+                    digest.update(chunk)
+            content_hash = cls._hashes[key] = digest.hexdigest()
+        return content_hash
+
+    @classmethod
+    def blob_hash(cls, key, read):
+        """Hash of the bytes returned by read(), which is called only when key is not cached yet"""
+        content_hash = cls._hashes.get(key)
+        if content_hash is None:
+            content_hash = cls._hashes[key] = hashlib.sha1(read()).hexdigest()
+        return content_hash
+
+    @classmethod
+    def get(cls, bot, path, content_hash):
+        return cls._ids.get((cls.bot_key(bot), path, content_hash))
+
+    @classmethod
+    def put(cls, bot, path, content_hash, file_id):
+        key = (cls.bot_key(bot), path, content_hash)
+        if not file_id or cls._ids.get(key) == file_id:
+            return
+        with cls._lock:
+            cls._ids[key] = file_id
+            if cls._connection:
+                with cls._connection:
+                    cls._connection.execute('INSERT OR REPLACE INTO file_ids (bot, path, hash, file_id) '
+                                            'VALUES (?, ?, ?, ?)', key + (file_id,))
+
+    @classmethod
+    def forget(cls, bot, path, content_hash):
+        key = (cls.bot_key(bot), path, content_hash)
+        with cls._lock:
+            cls._ids.pop(key, None)
+            if cls._connection:
+                with cls._connection:
+                    cls._connection.execute('DELETE FROM file_ids WHERE bot = ? AND path = ? AND hash = ?', key)
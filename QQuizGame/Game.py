@@ -2,20 +2,36 @@ import logging
 import os
 import pickle
 import threading
-from collections import defaultdict
 from copy import deepcopy
+from functools import lru_cache
 
 import yaml
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import Unauthorized, ChatMigrated
-from telegram.ext import Updater, CommandHandler, PicklePersistence, CallbackQueryHandler, MessageHandler, Filters
+from telegram.ext import Updater, CommandHandler, PicklePersistence, MessageHandler, Filters
 
 from QQuizGame import schedule
+from QQuizGame.AnswerMatcher import normalize
+from QQuizGame.Broadcast import Broadcast
+from QQuizGame.CallbackRouter import CallbackRouter
+from QQuizGame.ChatExecutor import ChatExecutor
+from QQuizGame.DeletionQueue import DeletionQueue
+from QQuizGame.EventLog import EventLog
+from QQuizGame.FileIdCache import FileIdCache
+from QQuizGame.GameCatalog import GameCatalog
+from QQuizGame.LevelCache import LevelCache
+from QQuizGame.LevelPicker import LevelPicker
+from QQuizGame.MediaStore import MediaStore
+from QQuizGame.MessageStack import MessageStack
 from QQuizGame.QuizKernel import QuizKernel
 from QQuizGame.ReadWrite import ReadWrite
+from QQuizGame.SQLitePersistence import SQLitePersistence
+from QQuizGame.Session import QuizSession
 from QQuizGame.Types import AnswerCorrectness
+from QQuizGame.Webhook import WebhookConfig, WebhookServer
 from QQuizGame.logging_setup import setup_logger
 
+DEFAULT_LOG_LEVELS = {'schedule': 'INFO', 'QQuizGame.QuizKernel': 'INFO'}
+
 
 class GameConfig:
     def __init__(self, config):
@@ -28,6 +44,30 @@ class GameConfig:
             self.user_db_path = config['user_db_path']
             self.no_spoilers_default = bool(int(config['no_spoilers_default']))
             self.admin_id = int(config['admin_id'])
+            self.level_cache_size = int(config.get('level_cache_size', 64 * 1024 * 1024))
+            self.persistence = config.get('persistence', 'pickle')
+            self.sqlite_db_path = config.get('sqlite_db_path', self.user_db_path + '.sqlite')
+            self.persistence_flush_interval = float(config.get('persistence_flush_interval', 5))
+            self.broadcast_workers = int(config.get('broadcast_workers', 8))
+            self.broadcast_rate = float(config.get('broadcast_rate', 30))
+            self.file_id_cache_path = config.get('file_id_cache_path', self.user_db_path + '.file_ids')
+            self.media_max_open = int(config.get('media_max_open', 32))
+            self.media_cache_size = int(config.get('media_cache_size', 16 * 1024 * 1024))
+            self.message_stack_size = int(config.get('message_stack_size', 200))
+            self.levels_page_size = int(config.get('levels_page_size', 10))
+            self.event_log_dir = config.get('event_log_dir',
+                                            os.path.join(os.path.dirname(self.logger_path), 'events'))
+            self.event_log_max_bytes = int(config.get('event_log_max_bytes', 16 * 1024 * 1024))
+            self.event_log_keep = int(config.get('event_log_keep', 0))
+            self.log_max_bytes = int(config.get('log_max_bytes', 10 * 1024 * 1024))
+            self.log_backup_count = int(config.get('log_backup_count', 5))
+            self.log_rotate_when = config.get('log_rotate_when') or None
+            self.log_compress = bool(int(config.get('log_compress', 1)))
+            self.log_levels = dict(DEFAULT_LOG_LEVELS, **(config.get('log_levels') or {}))
+            self.deletion_rate = float(config.get('deletion_rate', 20))
+            self.mode = config.get('mode', 'polling')
+            self.workers = int(config.get('workers', 0))
+            self.webhook = WebhookConfig(config)
             if 'game_of_the_day' in config:
                 self.game_of_the_day = config['game_of_the_day']
                 self.game_of_the_day_time = config['game_of_the_day_time']
@@ -40,42 +80,87 @@ class GameConfig:
 
 class Game:
     __name__ = "Game"
-    __version__ = 0.4
+    __version__ = 0.5
 
     def __init__(self, config_path: str):
         self.config = GameConfig(config_path)
-        puzzles_db = PicklePersistence(filename=self.config.user_db_path)
-        self.updater = Updater(self.config.token, use_context=True, persistence=puzzles_db)
+        LevelCache.set_budget(self.config.level_cache_size)
+        FileIdCache.configure(self.config.file_id_cache_path)
+        MediaStore.configure(max_open=self.config.media_max_open, budget=self.config.media_cache_size)
+        if self.config.persistence == 'sqlite':
+            puzzles_db = SQLitePersistence(self.config.sqlite_db_path,
+                                           self.config.persistence_flush_interval,
+                                           migrate_from=self.config.user_db_path)
+        else:
+            puzzles_db = PicklePersistence(filename=self.config.user_db_path)
+        self.updater = Updater(self.config.token, use_context=True, persistence=puzzles_db,
+                               request_kwargs={'con_pool_size': self.config.broadcast_workers + 8})
         self.init_dispatcher(self.updater.dispatcher)
 
         self.logger = setup_logger(__name__,
                                    self.config.logger_path,
-                                   logging.INFO)
+                                   logging.INFO,
+                                   max_bytes=self.config.log_max_bytes,
+                                   backup_count=self.config.log_backup_count,
+                                   when=self.config.log_rotate_when,
+                                   compress=self.config.log_compress,
+                                   levels=self.config.log_levels)
+        self.deletion_queue = DeletionQueue(self.updater.bot, self.config.deletion_rate, self.logger)
+        self.event_log = EventLog(self.config.event_log_dir, self.config.event_log_max_bytes,
+                                  self.config.event_log_keep, logger=self.logger)
+        self.executor = None
+        if self.config.workers:
+            self.executor = ChatExecutor(self.config.workers, self.logger)
+            self.executor.install(self.updater.dispatcher)
         self.game_of_day = None
+        self.gotd_lock = threading.Lock()
         if self.config.game_of_the_day:
             path_dir = os.path.join(self.config.games_db_path, self.config.game_of_the_day, 'master')
             last_lev, message_buff = 0, []
             if os.path.exists(self.config.game_of_the_day_db_path):
                 last_lev, message_buff = pickle.load(open(self.config.game_of_the_day_db_path, 'rb'))
-            self.game_of_day = QuizKernel(path_dir, last_lev)
+            self.game_of_day = QuizKernel.get(path_dir)
+            self.gotd_session = QuizSession(self.config.game_of_the_day, last_lev)
             self.__schedule_gotd()
-            self.gotd_prev_message = message_buff
+            self.gotd_prev_message = MessageStack(message_buff)
         self.input_event = self.__send_all_from_input()
         self.admin_text = ''
+        self.webhook = None
+
+    def start(self, demon=False):
+        if self.config.mode == 'webhook':
+            self.start_webhook(demon)
+        else:
+            self.start_polling(demon)
 
     def start_polling(self, demon=False):
         self.updater.start_polling()
         if not demon:
             self.updater.idle()
 
+    def start_webhook(self, demon=False):
+        self.webhook = WebhookServer(self.updater, self.config.webhook, self.logger)
+        self.webhook.start()
+        if not demon:
+            self.webhook.idle()
+
     def stop_polling(self):
         if hasattr(self, 'shed_event'):
             self.shed_event.set()
         if self.config.game_of_the_day:
-            pickle.dump([self.game_of_day.last_question_num, self.gotd_prev_message],
-                        open(self.config.game_of_the_day_db_path, 'wb'))
+            with self.gotd_lock:
+                pickle.dump([self.gotd_session.level, self.gotd_prev_message],
+                            open(self.config.game_of_the_day_db_path, 'wb'))
         self.input_event.set()
+        if self.webhook:
+            self.webhook.stop()
         self.updater.stop()
+        if self.executor:
+            self.executor.stop()
+        self.event_log.stop()
+        self.deletion_queue.stop()
+        self.updater.dispatcher.update_persistence()
+        self.updater.persistence.flush()
 
     def __get_chat_meta(self, update, context):
         if update.effective_message.chat.type == 'private':
@@ -88,39 +173,51 @@ class Game:
                 metadata['game_type'] = self.config.default_game
             if 'quiz' not in metadata.keys():
                 metadata['quiz'] = {}
-                path_dir = os.path.join(self.config.games_db_path, metadata['game_type'], 'master')
-                metadata['quiz'][metadata['game_type']] = QuizKernel(path_dir,
-                                                                     context.bot,
-                                                                     update.effective_message.chat_id)
+            if metadata['game_type'] not in metadata['quiz']:
+                metadata['quiz'][metadata['game_type']] = self.__kernel(metadata['game_type']).new_session(
+                    metadata['game_type'], context.bot, update.effective_message.chat_id)
             if 'no_spoiler' not in metadata.keys():
                 metadata['no_spoiler'] = self.config.no_spoilers_default
-            if 'message_stack' not in metadata.keys():
-                metadata['message_stack'] = []
+            if not isinstance(metadata.get('message_stack'), MessageStack) or \
+                    metadata['message_stack'].maxlen != self.config.message_stack_size:
+                # старые стеки хранили целые Message, переводим их в компактный вид
+                metadata['message_stack'] = MessageStack(metadata.get('message_stack', ()),
+                                                         self.config.message_stack_size)
             if 'game_of_day' not in metadata.keys():
                 metadata['game_of_day'] = True
             if 'answer_from_text' not in metadata.keys():
                 metadata['answer_from_text'] = True
-            if 'version' not in metadata.keys():
-                metadata['version'] = self.__version__
-                old_data = self.__get_game_meta(metadata['quiz'][metadata['game_type']])
-                metadata['quiz'][metadata['game_type']] = QuizKernel(*old_data)
-            if metadata['version'] != self.__version__:
+            if metadata.get('version') != self.__version__:
                 metadata['version'] = self.__version__
-                old_data = self.__get_game_meta(metadata['quiz'][metadata['game_type']])
-                metadata['quiz'][metadata['game_type']] = QuizKernel(*old_data)
+                self.__migrate_sessions(metadata)
         return metadata
 
+    @staticmethod
+    def __migrate_sessions(metadata):
+        # до 0.5 в базе лежали целые объекты QuizKernel, оставляем от них только номер уровня
+        metadata.pop('quiz_data', None)
+        metadata['quiz'] = {game_type: game if isinstance(game, QuizSession)
+                            else QuizSession(game_type, Game.__get_game_meta(game)[1])
+                            for game_type, game in metadata['quiz'].items()}
+
+    def __kernel(self, game_type):
+        return QuizKernel.get(os.path.join(self.config.games_db_path, game_type, 'master'))
+
+    def __game(self, metadata):
+        return self.__kernel(metadata['game_type']), metadata['quiz'][metadata['game_type']]
+
     @staticmethod
     def __check_meta(metadata, update):
         if not metadata:
             update.effective_message.reply_text("Видимо что-то сломалось. Введите /start, чтобы начать")
         return metadata
 
-    def __get_game_meta(self, game_metadata):
+    @staticmethod
+    def __get_game_meta(game_metadata):
         try:
             old_data = game_metadata.serialize_to_db()
         except:
-            old_data = game_metadata.working_dir, game_metadata.last_question_num
+            old_data = game_metadata.working_dir, game_metadata.__dict__.get('_last_question_num', 0)
         return old_data
 
     def __start(self, update, context):
@@ -129,13 +226,10 @@ class Game:
 
         if not metadata:
             metadata['game_type'] = self.config.default_game
-            metadata['quiz'] = defaultdict(QuizKernel)
-            path_dir = os.path.join(self.config.games_db_path, metadata['game_type'], 'master')
-            metadata['quiz'][metadata['game_type']] = QuizKernel(path_dir, last_question=0)
-            metadata['quiz_data'] = (path_dir, 0)
+            metadata['quiz'] = {metadata['game_type']: QuizSession(metadata['game_type'])}
             metadata['no_spoiler'] = self.config.no_spoilers_default \
                 if update.effective_message.chat.type != 'private' else False
-            metadata['message_stack'] = []
+            metadata['message_stack'] = MessageStack(maxlen=self.config.message_stack_size)
             metadata['game_of_day'] = True
             metadata['answer_from_text'] = True
             metadata['version'] = self.__version__
@@ -159,11 +253,8 @@ class Game:
             self.__set_game(update, context)
             self.logger.info('New user added %s', update.effective_user)
         else:
-            # этот странный трюк нужен в случае, если мы что-то обновили в игровом движке
-            old_data = self.__get_game_meta(metadata['quiz'][metadata['game_type']])
-            metadata['quiz'][metadata['game_type']] = QuizKernel(*old_data)
-
-            question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+            game, session = self.__game(metadata)
+            question, path = game.get_new_question(session)
             metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
 
     def __question(self, update, context):
@@ -172,7 +263,8 @@ class Game:
             return
         chat_id = update.effective_message.chat_id
         metadata['message_stack'].append(update.effective_message)
-        question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+        game, session = self.__game(metadata)
+        question, path = game.get_new_question(session)
 
         metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
 
@@ -182,7 +274,8 @@ class Game:
             return
         chat_id = update.effective_message.chat_id
 
-        help_reply = metadata['quiz'][metadata['game_type']].get_hint()
+        game, session = self.__game(metadata)
+        help_reply = game.get_hint(session)
         metadata['message_stack'].append(update.effective_message)
         metadata['message_stack'].append(context.bot.sendMessage(chat_id=chat_id, text=help_reply))
 
@@ -207,29 +300,22 @@ class Game:
                                                          "answer, можно воспользоваться комбинацией /+tab ответ"))
             return
 
-        self.logger.info('User %s answered %s in game %s on question %s',
-                         update.effective_user,
-                         answer,
-                         metadata['game_type'],
-                         metadata['quiz'][metadata['game_type']].last_question_num
-                         )
-        correctness = metadata['quiz'][metadata['game_type']].check_answer(answer)
+        game, session = self.__game(metadata)
+        correctness = game.check_answer(session, answer)
+        self.event_log.push(chat_id, update.effective_user.id, metadata['game_type'], session.level,
+                            normalize(answer), self.__outcome(correctness))
         if correctness == AnswerCorrectness.CORRECT:
-            self.logger.info('User %s solved puzzle %s from %s',
-                             update.effective_user,
-                             metadata['quiz'][metadata['game_type']].last_question_num, metadata['game_type'])
             if metadata['no_spoiler']:
-                for msg in metadata['message_stack']:
-                    try:
-                        context.bot.deleteMessage(msg.chat_id, msg.message_id)
-                    except:
-                        self.logger.warning('No message "%s"', msg)
+                self.deletion_queue.put(metadata['message_stack'])
             metadata['message_stack'].clear()
 
-            metadata['quiz'][metadata['game_type']].next()
-            question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+            game.next(session)
+            question, path = game.get_new_question(session)
             metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
 
+        elif correctness == AnswerCorrectness.CLOSE:
+            metadata['message_stack'].append(
+                update.effective_message.reply_text(text=self.__close_answer_text()))
         elif type(correctness) == str:
             metadata['message_stack'].append(
                 update.effective_message.reply_text(text=correctness))
@@ -237,10 +323,39 @@ class Game:
         else:
             self.logger.warning('Wrong answer type "%s"', correctness)
 
+    @staticmethod
+    def __outcome(correctness):
+        if correctness == AnswerCorrectness.CORRECT:
+            return 'correct'
+        elif correctness == AnswerCorrectness.CLOSE:
+            return 'close'
+        elif correctness == QuizKernel.wrong_reply:
+            return 'wrong'
+        return 'guess'
+
+    def __text_answer(self, update, context):
+        # отсекаем обычную болтовню в группах до того, как трогать состояние чата и писать в лог,
+        # в личке на любой текст отвечаем как раньше
+        if update.effective_message.chat.type != 'private':
+            metadata = context.chat_data
+            text = update.effective_message.text
+            if metadata and 'quiz' in metadata and not text.startswith('/'):
+                if not metadata.get('answer_from_text', True):
+                    return
+                session = metadata['quiz'].get(metadata.get('game_type'))
+                if isinstance(session, QuizSession) and not self.__kernel(session.game).may_be_answer(session, text):
+                    return
+        self.__answer(update, context)
+
+    @staticmethod
+    def __close_answer_text():
+        return "Почти! Проверь, нет ли опечатки"
+
     def __get_answer(self, update, context):
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         chat_id = update.effective_message.chat_id
-        context.bot.sendMessage(text=metadata['quiz'][metadata['game_type']].get_answer(), chat_id=chat_id)
+        game, session = self.__game(metadata)
+        context.bot.sendMessage(text=game.get_answer(session), chat_id=chat_id)
 
     def __error(self, update, context):
         """Log Errors caused by Updates."""
@@ -258,6 +373,7 @@ class Game:
         return "Точно? Все сохранения в игре удалятся."
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def __reset_markup():
         keyboard = [[InlineKeyboardButton("Точно", callback_data='reset-1'),
                      InlineKeyboardButton("Нет", callback_data='reset-0')]]
@@ -270,11 +386,12 @@ class Game:
         chat_id = update.effective_message.chat_id
         if not metadata:
             return
-        button = bool(int(query.data.split('-')[-1]))
+        button = bool(int(context.args[0]))
         if bool(button):
             update.effective_message.delete()
-            metadata['quiz'][metadata['game_type']].reset()
-            question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+            game, session = self.__game(metadata)
+            game.reset(session)
+            question, path = game.get_new_question(session)
             metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
             self.logger.info('User %s reset %s',
                              update.effective_user,
@@ -287,7 +404,7 @@ class Game:
         chat_id = update.effective_message.chat_id
         if not metadata:
             return
-        reply_markup = ReadWrite.parse_game_folders_markup(self.config.games_db_path)
+        reply_markup = GameCatalog.get(self.config.games_db_path).markup()
         context.bot.sendMessage(text=self.__settings_game_text(metadata['game_type'], False),
                                 chat_id=chat_id,
                                 reply_markup=reply_markup)
@@ -313,6 +430,7 @@ class Game:
         return 'Выбери нужную настройку'
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def __settings_main_markup():
         keyboard = [[InlineKeyboardButton("Игры", callback_data='m1-game_type'),
                      InlineKeyboardButton("No spoilers", callback_data='m2-no_spoiler_mode')],
@@ -329,7 +447,7 @@ class Game:
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         if not metadata:
             return
-        reply_markup = ReadWrite.parse_game_folders_markup(self.config.games_db_path)
+        reply_markup = GameCatalog.get(self.config.games_db_path).markup()
         query.edit_message_text(text=self.__settings_game_text(metadata['game_type']),
                                 reply_markup=reply_markup)
 
@@ -346,22 +464,20 @@ class Game:
         chat_id = update.effective_message.chat_id
         if not metadata:
             return
-        button = query.data.split('-')[-1]
-        if button in metadata['quiz'].keys():
-            metadata['game_type'] = button
-            old_data = self.__get_game_meta(metadata['quiz'][metadata['game_type']])
-            metadata['quiz'][metadata['game_type']] = QuizKernel(*old_data)
-        else:
-            metadata['game_type'] = button
-            path_dir = os.path.join(self.config.games_db_path, metadata['game_type'], 'master')
-            metadata['quiz'][metadata['game_type']] = QuizKernel(path_dir,
-                                                                 0,
-                                                                 context.bot,
-                                                                 update.effective_message.chat_id)
+        button = context.args[0]
+        if button not in GameCatalog.get(self.config.games_db_path):
+            query.answer(text=CallbackRouter.stale_text)
+            return
+        metadata['game_type'] = button
+        if button not in metadata['quiz'].keys():
+            metadata['quiz'][button] = self.__kernel(button).new_session(button,
+                                                                         context.bot,
+                                                                         update.effective_message.chat_id)
         self.logger.info('User %s set new game type %s',
                          update.effective_user,
                          metadata['game_type'])
-        question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+        game, session = self.__game(metadata)
+        question, path = game.get_new_question(session)
         metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
 
         query.answer(text='Теперь играем в ' + button)
@@ -382,6 +498,7 @@ class Game:
                "в групповых чатах " + " (сейчас " + str(status) + ")"
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def __settings_spoiler_markup():
         keyboard = [[InlineKeyboardButton("Вкл", callback_data='m2_1-1'),
                      InlineKeyboardButton("Выкл", callback_data='m2_1-0')],
@@ -395,7 +512,7 @@ class Game:
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         if not metadata:
             return
-        button = bool(int(query.data.split('-')[-1]))
+        button = bool(int(context.args[0]))
         metadata['no_spoiler'] = button
         query.answer(text="Режим no spoilers включен" if button else "Режим no spoilers выключен")
         query.edit_message_text(
@@ -421,6 +538,7 @@ class Game:
                " (сейчас " + str(status) + ")"
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def __settings_gotd_markup():
         keyboard = [[InlineKeyboardButton("Вкл", callback_data='m3_1-1'),
                      InlineKeyboardButton("Выкл", callback_data='m3_1-0')],
@@ -434,7 +552,7 @@ class Game:
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         if not metadata:
             return
-        button = bool(int(query.data.split('-')[-1]))
+        button = bool(int(context.args[0]))
         metadata['game_of_day'] = button
         query.answer(text="Режим загадки дня включен" if button else "Режим загадки дня выключен")
         query.edit_message_text(
@@ -462,6 +580,7 @@ class Game:
                " (сейчас " + str(status) + ")"
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def __settings_answer_message_markup():
         keyboard = [[InlineKeyboardButton("Вкл", callback_data='m4_1-1'),
                      InlineKeyboardButton("Выкл", callback_data='m4_1-0')],
@@ -475,7 +594,7 @@ class Game:
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         if not metadata:
             return
-        button = bool(int(query.data.split('-')[-1]))
+        button = bool(int(context.args[0]))
         metadata['answer_from_text'] = button
         query.answer(text="Ответы будут приниматься из сообщений" if button else "Ответ только после команды /answer")
         query.edit_message_text(
@@ -493,40 +612,48 @@ class Game:
         update.effective_message.delete()
 
     @staticmethod
-    def __levels_markup(game):
-        levels = game.get_all_levels()
-        if not levels:
-            return None
-        keyboard = [[]]
-        for i, level in enumerate(levels):
-            if len(keyboard[-1]) == 1:
-                keyboard.append([])
-            num, lev = level[0], " ".join(level[1].split('_'))
-            keyboard[-1].append(
-                InlineKeyboardButton(str(int(num) + 1) + '. ' + lev,
-                                     callback_data='game_level-' + level[0] + "-@" + level[1]))
-        keyboard.append([InlineKeyboardButton("Done", callback_data='done')])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        return reply_markup
+    def __levels_text(page, page_count):
+        if page_count > 1:
+            return 'Выберите уровень (страница {} из {})'.format(page + 1, page_count)
+        return 'Выберите уровень'
 
-    def __set_level(self, update, context):  # todo: добавить кнопку exit
+    def __set_level(self, update, context):
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
-        levels_markup = self.__levels_markup(metadata['quiz'][metadata['game_type']])
-        if levels_markup:
-            update.effective_message.reply_text('Выберите уровень',
-                                                reply_markup=levels_markup)
+        if not metadata:
+            return
+        game, session = self.__game(metadata)
+        page_size = self.config.levels_page_size
+        picked = LevelPicker.page(game, page_size, LevelPicker.page_of(game, session, page_size), session)
+        if picked:
+            markup, page, page_count = picked
+            update.effective_message.reply_text(self.__levels_text(page, page_count),
+                                                reply_markup=markup)
         else:
             update.effective_message.reply_text("Выбор уровня невозможен в этом режиме игры")
 
+    def __levels_page(self, update, context):
+        query = update.callback_query
+        metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
+        if not metadata:
+            return
+        game, session = self.__game(metadata)
+        picked = LevelPicker.page(game, self.config.levels_page_size, int(context.args[0]), session)
+        if not picked:
+            query.answer(text=CallbackRouter.stale_text)
+            return
+        markup, page, page_count = picked
+        query.edit_message_text(text=self.__levels_text(page, page_count), reply_markup=markup)
+
     def __levels_button(self, update, context):
         query = update.callback_query
         metadata = self.__check_meta(self.__get_chat_meta(update, context), update)
         chat_id = update.effective_message.chat_id
         if not metadata:
             return
-        button = '-'.join(query.data.split('-')[1:])
-        metadata['quiz'][metadata['game_type']].set_level_by_name(button)
-        question, path = metadata['quiz'][metadata['game_type']].get_new_question()
+        button = context.args[0]
+        game, session = self.__game(metadata)
+        game.set_level_by_name(session, button)
+        question, path = game.get_new_question(session)
         metadata['message_stack'] += ReadWrite.send(question, context.bot, chat_id, path)
         update.effective_message.delete()
         self.logger.info('User %s changed level to %s',
@@ -566,87 +693,99 @@ class Game:
         https://github.com/qashqay654/QashqayQuizBot""", chat_id=chat_id)
 
     def __game_of_the_day_send(self):
-        if self.gotd_prev_message:
-            self.game_of_day.next()
-            for message in self.gotd_prev_message:
-                try:
-                    # self.updater.bot.edit_message_text(text=message.text,
-                    #                                   chat_id=message.chat_id,
-                    #                                   message_id=message.message_id)
-                    self.updater.bot.delete_message(message.chat_id, message.message_id)
-                except:
-                    self.logger.warning('No message "%s"', message)
-            self.gotd_prev_message.clear()
+        # сессия загадки дня общая для всех чатов, а обработчики могут работать в нескольких потоках
+        with self.gotd_lock:
+            if self.gotd_prev_message:
+                self.game_of_day.next(self.gotd_session)
+                self.deletion_queue.put(self.gotd_prev_message, DeletionQueue.BULK)
+                self.gotd_prev_message.clear()
+
+            reply_markup = self.__gotd_markup()
+            if self.game_of_day:
+                question, path = self.game_of_day.get_new_question(self.gotd_session)
+            else:
+                return
+        report = self.__broadcast(lambda bot, chat_id: ReadWrite.send(question, bot, chat_id, path,
+                                                                      reply_markup=reply_markup,
+                                                                      game_of_day=True),
+                                  game_of_day=True)
+        with self.gotd_lock:
+            for messages in report.results.values():
+                self.gotd_prev_message += messages
+            pickle.dump([self.gotd_session.level, self.gotd_prev_message],
+                        open(self.config.game_of_the_day_db_path, 'wb'))
+        self.logger.info('Game of the day send')
 
-        keyboard = [[InlineKeyboardButton("Посмотреть ответ", callback_data='gotd_answ'),
-                     InlineKeyboardButton("Скрыть", callback_data='done')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        if self.game_of_day:
-            question, path = self.game_of_day.get_new_question()
-        else:
-            return
-        user_data = self.updater.dispatcher.user_data
-        for user in list(user_data):
-            if user_data[user]:
-                if 'game_of_day' not in user_data[user]:
-                    user_data[user]['game_of_day'] = True
-                if user_data[user]['game_of_day']:
-                    try:
-                        self.gotd_prev_message += ReadWrite.send(question, self.updater.bot,
-                                                                 user, path,
-                                                                 reply_markup=reply_markup,
-                                                                 game_of_day=True
-                                                                 )
-                    except Unauthorized as ua:
-                        del user_data[user]
-                        self.logger.warning("User %s is deleted", user)
+    def __remember_gotd(self, messages):
+        with self.gotd_lock:
+            self.gotd_prev_message.extend(messages)
 
+    def __broadcast(self, job, game_of_day=False):
+        user_data = self.updater.dispatcher.user_data
         chat_data = self.updater.dispatcher.chat_data
-        for chat in list(chat_data):
-            if chat_data[chat]:
-                if 'game_of_day' not in chat_data[chat]:
-                    chat_data[chat]['game_of_day'] = True
-                if chat_data[chat]['game_of_day']:
-                    try:
-                        self.gotd_prev_message += ReadWrite.send(question, self.updater.bot,
-                                                                 chat, path,
-                                                                 reply_markup=reply_markup,
-                                                                 game_of_day=True)
-                    except Unauthorized as ua:
-                        del chat_data[chat]
-                        self.logger.warning("Chat %s is deleted", chat)
-                    except ChatMigrated as e:
-                        chat_data[e.new_chat_id] = deepcopy(chat_data[chat])
-                        del chat_data[chat]
-                        self.logger.warning("Chat %s is migrated", chat)
-                        self.gotd_prev_message += ReadWrite.send(question, self.updater.bot,
-                                                                 e.new_chat_id, path,
-                                                                 reply_markup=reply_markup,
-                                                                 game_of_day=True)
-        pickle.dump([self.game_of_day.last_question_num, self.gotd_prev_message],
-                    open(self.config.game_of_the_day_db_path, 'wb'))
-        self.logger.info('Game of the day send')
+        recipients = {}
+        for data in (user_data, chat_data):
+            for chat_id in list(data):
+                if not data[chat_id]:
+                    continue
+                if game_of_day:
+                    if 'game_of_day' not in data[chat_id]:
+                        data[chat_id]['game_of_day'] = True
+                    if not data[chat_id]['game_of_day']:
+                        continue
+                recipients[chat_id] = True
+
+        report = Broadcast(self.updater.bot,
+                           workers=self.config.broadcast_workers,
+                           rate=self.config.broadcast_rate,
+                           logger=self.logger).run(recipients, job)
+
+        persistence = self.updater.persistence
+        for chat_id in report.blocked:
+            if chat_id in user_data:
+                del user_data[chat_id]
+                if hasattr(persistence, 'drop_user_data'):
+                    persistence.drop_user_data(chat_id)
+                self.logger.warning("User %s is deleted", chat_id)
+            if chat_id in chat_data:
+                del chat_data[chat_id]
+                if hasattr(persistence, 'drop_chat_data'):
+                    persistence.drop_chat_data(chat_id)
+                self.logger.warning("Chat %s is deleted", chat_id)
+        for old_chat_id, new_chat_id in report.migrated.items():
+            if old_chat_id in chat_data:
+                chat_data[new_chat_id] = deepcopy(chat_data[old_chat_id])
+                del chat_data[old_chat_id]
+                if hasattr(persistence, 'drop_chat_data'):
+                    persistence.drop_chat_data(old_chat_id)
+                self.logger.warning("Chat %s is migrated", old_chat_id)
+        return report
 
     def __repeat_goth(self, update, context):
         chat_id = update.effective_message.chat_id
+        reply_markup = self.__gotd_markup()
+        question, path = self.game_of_day.get_new_question(self.gotd_session)
+        self.__remember_gotd(ReadWrite.send(question, self.updater.bot,
+                                            chat_id, path,
+                                            reply_markup=reply_markup,
+                                            game_of_day=True
+                                            ))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def __gotd_markup():
         keyboard = [[InlineKeyboardButton("Посмотреть ответ", callback_data='gotd_answ'),
                      InlineKeyboardButton("Скрыть", callback_data='done')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        question, path = self.game_of_day.get_new_question()
-        self.gotd_prev_message += ReadWrite.send(question, self.updater.bot,
-                                                 chat_id, path,
-                                                 reply_markup=reply_markup,
-                                                 game_of_day=True
-                                                 )
+        return InlineKeyboardMarkup(keyboard)
 
     def __game_of_the_day_button(self, update, context):
         query = update.callback_query
         if self.game_of_day:
-            query.answer(text=self.game_of_day.get_hint(), show_alert=True)
+            query.answer(text=self.game_of_day.get_hint(self.gotd_session), show_alert=True)
 
     def __schedule_gotd(self):
         schedule.every().day.at(self.config.game_of_the_day_time).do(self.__game_of_the_day_send)
-        print("Scheduler set at " + self.config.game_of_the_day_time)
+        self.logger.info('Scheduler set at %s', self.config.game_of_the_day_time)
         self.shed_event = schedule.run_continuously()
 
     def __gotd_answer(self, update, context):
@@ -654,26 +793,23 @@ class Game:
 
         answer = ' '.join(context.args).lower()
         if not answer:
-            self.gotd_prev_message.append(update.effective_message.reply_text(text="Укажи ответ аргументом после "
-                                                                                   "команды /dq, например: "
-                                                                                   "/dq 1984"))
+            self.__remember_gotd([update.effective_message.reply_text(text="Укажи ответ аргументом после "
+                                                                           "команды /dq, например: "
+                                                                           "/dq 1984")])
             return
 
-        correctness = self.game_of_day.check_answer(answer)
-        self.logger.info('User %s answered %s in %s',
-                         update.effective_user,
-                         answer,
-                         "game of the day"
-                         )
+        # сессия загадки дня общая, check_answer отмечает в ней решённый уровень
+        with self.gotd_lock:
+            level = self.gotd_session.level
+            correctness = self.game_of_day.check_answer(self.gotd_session, answer)
+        self.event_log.push(chat_id, update.effective_user.id, self.config.game_of_the_day, level,
+                            normalize(answer), self.__outcome(correctness))
         if correctness == AnswerCorrectness.CORRECT:
-            self.logger.info('User %s solved %s',
-                             update.effective_user,
-                             "game of the day"
-                             )
-            self.gotd_prev_message.append(update.effective_message.reply_text(text="Правильно!"))
+            self.__remember_gotd([update.effective_message.reply_text(text="Правильно!")])
+        elif correctness == AnswerCorrectness.CLOSE:
+            self.__remember_gotd([update.effective_message.reply_text(text=self.__close_answer_text())])
         elif type(correctness) == str:
-            self.gotd_prev_message.append(
-                context.bot.sendMessage(chat_id=chat_id, text=correctness))
+            self.__remember_gotd([context.bot.sendMessage(chat_id=chat_id, text=correctness)])
         else:
             self.logger.warning('Wrong answer type "%s"', correctness)
 
@@ -696,35 +832,36 @@ class Game:
 
     def __send_all_from_admin_button(self, update, context):
         query = update.callback_query
-        button = bool(int(query.data.split('-')[-1]))
+        button = bool(int(context.args[0]))
         query.edit_message_text(text=self.admin_text)
         if button:
-            user_data = self.updater.dispatcher.user_data
-            for user in list(user_data):
-                if user_data[user]:
-                    try:
-                        self.updater.bot.sendMessage(text=self.admin_text, chat_id=user)
-                    except Unauthorized as ua:
-                        del user_data[user]
-                        self.logger.warning("User %s is deleted", user)
-            chat_data = self.updater.dispatcher.chat_data
-            for chat in list(chat_data):
-                if chat_data[chat]:
-                    try:
-                        self.updater.bot.sendMessage(text=self.admin_text, chat_id=chat)
-                    except Unauthorized as ua:
-                        del chat_data[chat]
-                        self.logger.warning("Chat %s is deleted", chat)
-                    except ChatMigrated as e:
-                        chat_data[e.new_chat_id] = deepcopy(chat_data[chat])
-                        del chat_data[chat]
-                        self.logger.warning("Chat %s is migrated", chat)
-                        self.updater.bot.sendMessage(text=self.admin_text, chat_id=e.new_chat_id)
+            text = self.admin_text
+            # рассылка идёт часами на больших базах, диспетчер её не ждёт
+            job = lambda bot, chat_id: bot.sendMessage(chat_id, text=text)
+            threading.Thread(target=self.__broadcast, args=(job,), name='AdminBroadcast', daemon=True).start()
         self.logger.info("Admin message send %s", self.admin_text)
         self.admin_text = ''
 
+    def __cache_stats(self, update, context):
+        if update.effective_message.from_user.id != self.config.admin_id:
+            return
+        stats = LevelCache.stats()
+        media = MediaStore.stats()
+        update.effective_message.reply_text(text="Level cache: {hits} hits, {misses} misses, {levels} levels, "
+                                                 "{bytes}/{budget} bytes\n".format(**stats) +
+                                                 "Media: {open}/{max_open} open (peak {peak}), {fds} fds, "
+                                                 "{hits} hits, {misses} misses, {files} files, "
+                                                 "{bytes}/{budget} bytes\n".format(**media) +
+                                                 "Deletion: {} pending, {} deleted, {} dropped\n".format(
+                                                     self.deletion_queue.pending,
+                                                     self.deletion_queue.deleted,
+                                                     self.deletion_queue.dropped) +
+                                                 "Events: {queued} queued, {written} written, {dropped} dropped, "
+                                                 "{pending} pending (peak {peak})".format(**self.event_log.stats()))
+
     def __send_all_from_input(self):
         cease_continuous_run = threading.Event()
+        broadcast = self.__broadcast
 
         class MassiveSender(threading.Thread):
             @classmethod
@@ -741,27 +878,7 @@ class Game:
                         continue
                     else:
                         print('Sending')
-                    user_data = self.updater.dispatcher.user_data
-                    for user in list(user_data):
-                        if user_data[user]:
-                            try:
-                                self.updater.bot.sendMessage(text=message, chat_id=user)
-                            except Unauthorized as ua:
-                                del user_data[user]
-                                self.logger.warning("User %s is deleted", user)
-                    chat_data = self.updater.dispatcher.chat_data
-                    for chat in list(chat_data):
-                        if chat_data[chat]:
-                            try:
-                                self.updater.bot.sendMessage(text=message, chat_id=chat)
-                            except Unauthorized as ua:
-                                del chat_data[chat]
-                                self.logger.warning("Chat %s is deleted", chat)
-                            except ChatMigrated as e:
-                                chat_data[e.new_chat_id] = deepcopy(chat_data[chat])
-                                del chat_data[chat]
-                                self.logger.warning("Chat %s is migrated", chat)
-                                self.updater.bot.sendMessage(text=message, chat_id=e.new_chat_id)
+                    broadcast(lambda bot, chat_id: bot.sendMessage(chat_id, text=message))
                     self.logger.info("Admin message send %s", message)
 
         continuous_thread = MassiveSender()
@@ -787,31 +904,34 @@ class Game:
                                               pass_user_data=True, pass_chat_data=True))
         dispatcher.add_handler(CommandHandler("dq", self.__gotd_answer))
         dispatcher.add_handler(CommandHandler("repeatdq", self.__repeat_goth))
-        dispatcher.add_handler(CallbackQueryHandler(self.__reset_button, pattern='^reset-'))
 
         dispatcher.add_handler(CommandHandler("settings", self.__settings,
                                               pass_user_data=True, pass_chat_data=True))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_main, pattern='main'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_done, pattern='done'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_game, pattern='^m1-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_game_button, pattern='^puzzname'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_spoiler, pattern='^m2-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_spoiler_button, pattern='^m2_1-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_gotd, pattern='^m3-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_gotd_button, pattern='^m3_1-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__game_of_the_day_button, pattern='gotd_answ'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_answer_message, pattern='^m4-'))
-        dispatcher.add_handler(CallbackQueryHandler(self.__settings_answer_message_button, pattern='^m4_1-'))
 
         dispatcher.add_handler(CommandHandler("adminsend", self.__send_all_from_admin))
-        dispatcher.add_handler(CallbackQueryHandler(self.__send_all_from_admin_button, pattern='^admin_send-'))
+        dispatcher.add_handler(CommandHandler("cachestats", self.__cache_stats))
 
         dispatcher.add_handler(CommandHandler("setlevel", self.__set_level,
                                               pass_user_data=True, pass_chat_data=True))
-        dispatcher.add_handler(CallbackQueryHandler(self.__levels_button, pattern='^game_level-'))
 
-        dispatcher.add_handler(MessageHandler(Filters.text, self.__answer))
+        router = CallbackRouter()
+        router.add('reset', self.__reset_button)
+        router.add('main', self.__settings_main)
+        router.add('done', self.__settings_done)
+        router.add('m1', self.__settings_game)
+        router.add('puzzname', self.__settings_game_button)
+        router.add('m2', self.__settings_spoiler)
+        router.add('m2_1', self.__settings_spoiler_button)
+        router.add('m3', self.__settings_gotd)
+        router.add('m3_1', self.__settings_gotd_button)
+        router.add('gotd_answ', self.__game_of_the_day_button)
+        router.add('m4', self.__settings_answer_message)
+        router.add('m4_1', self.__settings_answer_message_button)
+        router.add('admin_send', self.__send_all_from_admin_button)
+        router.add('game_level', self.__levels_button)
+        router.add('level_page', self.__levels_page)
+        dispatcher.add_handler(router.handler())
+
+        dispatcher.add_handler(MessageHandler(Filters.text, self.__text_answer))
         dispatcher.add_error_handler(self.__error)
         # TODO: add random talk
-
-# todo: прописать нормальный логгер вместо принтов
@@ -0,0 +1,72 @@
+import os
+import time
+
+from natsort import natsorted
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from QQuizGame.CallbackRouter import CallbackRouter
+from QQuizGame.Shared import Shared
+
+
+class GameInfo:
+    """One game folder of the catalog"""
+    __slots__ = ('name', 'path', 'hidden')
+
+    def __init__(self, parent: str, name: str):
+        self.name = name
+        self.path = os.path.join(parent, name, 'master')
+        self.hidden = name.startswith('.')
+
+    def __repr__(self):
+        return 'GameInfo(%r)' % self.name
+
+
+class GameCatalog(Shared):
+    """Games of a folder with prebuilt keyboards, the folder mtime is checked at most once in check_interval.
+    Games starting with '.' are shown to authors only."""
+    check_interval = 1.0
+
+    def __init__(self, parent: str):
+        self.parent = parent
+        self.games = []
+        self._names = {}
+        self._markups = {}
+        self._checked = 0.0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        self._reload(os.stat(self.parent).st_mtime_ns, self.__load)
+
+    def __load(self):
+        games = [GameInfo(self.parent, name) for name in natsorted(os.listdir(self.parent))
+                 if os.path.isdir(os.path.join(self.parent, name))]
+        self.games = games
+        self._names = {game.name: game for game in games}
+        self._markups = {is_author: self.__build_markup(games, is_author) for is_author in (False, True)}
+
+    @staticmethod
+    def __build_markup(games, is_author):
+        keyboard = [[]]
+        for game in games:
+            if game.hidden and not is_author:
+                continue
+            if len(keyboard[-1]) == 2:
+                keyboard.append([])
+            data = CallbackRouter.pack('puzzname', game.name, pinned=True)
+            keyboard[-1].append(InlineKeyboardButton(game.name, callback_data=data))
+        return InlineKeyboardMarkup(keyboard)
+
+    def markup(self, is_author=False):
+        return self._markups[is_author]
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __getitem__(self, name):
+        return self._names[name]
+
+    def __len__(self):
+        return len(self.games)
@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from QQuizGame.AnswerMatcher import AnswerMatcher, normalize
+from QQuizGame.ReadWrite import ReadWrite
+
+
+class Level:
+    """Parsed and immutable puzzle: question messages, answers, hints and guesses."""
+    __slots__ = ('puzzle_dir', 'question', 'answer', 'hint', 'guess', 'matcher', 'size')
+
+    def __init__(self, puzzle_dir, question, pre_answer, close_distance=0):
+        answer, hint, guess = [], [], []
+        for answ in pre_answer:
+            if answ.startswith('?') and len(answ[1:].split('?')) == 2:
+                temp = answ[1:].split('?')
+                guess.append((normalize(temp[0]), temp[1].strip()))
+            elif answ.startswith("<") and answ.endswith(">"):
+                hint.append(answ[1:-1].lower().strip())
+            else:
+                answer.append(normalize(answ))
+        if not len(answer):
+            answer.append("")
+        if not len(hint):
+            hint.append("")
+        if not len(guess):
+            guess.append(("", ""))
+
+        self.puzzle_dir = puzzle_dir
+        self.question = tuple(tuple(message) for message in question)
+        self.answer = tuple(answer)
+        self.hint = tuple(hint)
+        self.guess = tuple(guess)
+        self.matcher = AnswerMatcher(self.answer, self.guess, close_distance)
+        self.size = _sizeof((self.puzzle_dir, self.question, self.answer, self.hint, self.guess,
+                             self.matcher.answers, self.matcher.guesses, self.matcher.neighbours,
+                             self.matcher.alphabet))
+
+    @classmethod
+    def load(cls, puzzle_dir, close_distance=0):
+        return cls(puzzle_dir, *ReadWrite.read_level(puzzle_dir), close_distance)
+
+
+def _sizeof(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list, set, frozenset)):
+        size += sum(_sizeof(item) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(_sizeof(key) + _sizeof(value) for key, value in obj.items())
+    return size
+
+
+class LevelCache:
+    """Process-wide LRU of parsed levels keyed by (puzzle_dir, files mtime, close distance), bounded in bytes."""
+    budget = 64 * 1024 * 1024
+    hits = 0
+    misses = 0
+
+    _levels = OrderedDict()
+    _used = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def set_budget(cls, budget: int):
+        with cls._lock:
+            cls.budget = budget
+            cls.__evict()
+
+    @classmethod
+    def get(cls, puzzle_dir: str, close_distance=0, bundle=None):
+        if bundle:
+            key = (puzzle_dir, bundle.mtime, close_distance)
+        else:
+            key = (puzzle_dir, ReadWrite.level_mtime(puzzle_dir), close_distance)
+        with cls._lock:
+            level = cls._levels.get(key)
+            if level is not None:
+                cls._levels.move_to_end(key)
+                cls.hits += 1
+                return level
+            cls.misses += 1
+
+        if bundle:
+            level = Level(puzzle_dir, *bundle.read_level(os.path.basename(puzzle_dir)), close_distance)
+        else:
+            level = Level.load(puzzle_dir, close_distance)
+        with cls._lock:
+            if key not in cls._levels:
+                cls._levels[key] = level
+                cls._used += level.size
+                cls.__evict()
+        return level
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return {'hits': cls.hits,
+                    'misses': cls.misses,
+                    'levels': len(cls._levels),
+                    'bytes': cls._used,
+                    'budget': cls.budget}
+
+    @classmethod
+    def __evict(cls):
+        while cls._levels and cls._used > cls.budget:
+            _, level = cls._levels.popitem(last=False)
+            cls._used -= level.size
@@ -0,0 +1,38 @@
+"""Pickle-free level record: compact utf-8 json in level.json"""
+import json
+import os
+
+from QQuizGame.Types import FileType
+
+LEVEL_FILE = 'level.json'
+# {"v": 1, "q": [[FileType name, field1, field2, is_media, media_path], ...], "a": [answer, ...]}
+VERSION = 1
+
+
+def encode(question, answer):
+    return json.dumps({'v': VERSION,
+                       'q': [[message[0].name, message[1], message[2], message[3], message[4]]
+                             for message in question],
+                       'a': list(answer)},
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode(data):
+    record = json.loads(data)
+    if record['v'] != VERSION:
+        raise ValueError("Unsupported level format version " + str(record['v']))
+    return [[FileType[message[0]], message[1], message[2], message[3], message[4]] for message in record['q']], \
+        record['a']
+
+
+def write(puzzle_dir, question, answer):
+    file_name = os.path.join(puzzle_dir, LEVEL_FILE)
+    with open(file_name + '.tmp', 'wb') as handle:
+        handle.write(encode(question, answer))
+    os.replace(file_name + '.tmp', file_name)
+    return file_name
+
+
+def read(puzzle_dir):
+    with open(os.path.join(puzzle_dir, LEVEL_FILE), 'rb') as handle:
+        return decode(handle.read())
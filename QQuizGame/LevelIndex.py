@@ -0,0 +1,49 @@
+import os
+
+from natsort import natsorted
+
+from QQuizGame.Bundle import Bundle
+from QQuizGame.Shared import Shared
+
+
+class LevelIndex(Shared):
+    """Natsorted level folders of one game (or levels of its bundle), listed again when the folder mtime changes"""
+
+    def __init__(self, working_dir: str):
+        self.working_dir = working_dir
+        self.levels = []
+        self.parts = []
+        self._positions = {}
+        self.bundle = None
+
+    def refresh(self):
+        bundle = Bundle.get(self.working_dir)
+        mtime = ('bundle', bundle.mtime) if bundle else os.stat(self.working_dir).st_mtime_ns
+        self._reload(mtime, lambda: self.__load(bundle))
+
+    def __load(self, bundle):
+        if bundle:
+            levels = bundle.levels
+        else:
+            levels = natsorted([dr for dr in os.listdir(self.working_dir)
+                                if not dr.startswith('-') and os.path.isdir(os.path.join(self.working_dir, dr))])
+        self.bundle = bundle
+        self.levels = levels
+        self.parts = [level.split('-@') for level in levels]
+        self._positions = {level: i for i, level in enumerate(levels)}
+
+    @property
+    def version(self):
+        return self._version
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, item):
+        return self.levels[item]
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def index(self, name):
+        return self._positions[name]
@@ -0,0 +1,74 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from QQuizGame.CallbackRouter import CallbackRouter
+from QQuizGame.LevelIndex import LevelIndex
+from QQuizGame.Shared import Registry
+
+
+class LevelPicker:
+    """Pages of the /setlevel menu built once per (game, level index version, step, page size),
+    levels solved in the session are marked with solved_mark"""
+    solved_mark = '✓ '
+    _pages = Registry()
+
+    @classmethod
+    def pages(cls, kernel, page_size: int):
+        """Tuple of (page markup, level numbers of its buttons) or None if the game doesn't allow to choose
+        a level"""
+        if not kernel.config.change_level_step:
+            return None
+        key = (kernel.working_dir, page_size)
+        index = LevelIndex.get(kernel.working_dir)
+        version = (index.version, kernel.config.change_level_step)
+        cached = cls._pages.setup(key, lambda: (version, cls.__build(index, kernel.get_all_levels() or [], page_size)),
+                                  lambda cached: cached[0] != version)
+        return cached[1] or None
+
+    @classmethod
+    def page(cls, kernel, page_size: int, page: int, session=None):
+        """(markup, page, page count) of a page clamped to the existing ones or None"""
+        pages = cls.pages(kernel, page_size)
+        if not pages:
+            return None
+        page = min(max(page, 0), len(pages) - 1)
+        markup, levels = pages[page]
+        if session is not None and session.solved:
+            markup = cls.__mark(markup, [session.is_solved(level) for level in levels])
+        return markup, page, len(pages)
+
+    @classmethod
+    def __mark(cls, markup, solved):
+        if not any(solved):
+            return markup
+        keyboard = [list(row) for row in markup.inline_keyboard]
+        for row, is_solved in zip(keyboard, solved):
+            if is_solved:
+                row[0] = InlineKeyboardButton(cls.solved_mark + row[0].text, callback_data=row[0].callback_data)
+        return InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def page_of(kernel, session, page_size: int):
+        step = kernel.config.change_level_step or 1
+        return session.level // step // page_size
+
+    @staticmethod
+    def __build(index, levels, page_size):
+        page_count = (len(levels) + page_size - 1) // page_size
+        pages = []
+        for page in range(page_count):
+            keyboard = []
+            page_levels = levels[page * page_size:(page + 1) * page_size]
+            for num, name in page_levels:
+                data = CallbackRouter.pack('game_level', num + "-@" + name, pinned=True)
+                keyboard.append([InlineKeyboardButton(str(int(num) + 1) + '. ' + " ".join(name.split('_')),
+                                                      callback_data=data)])
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("‹ Назад", callback_data='level_page-' + str(page - 1)))
+            if page < page_count - 1:
+                navigation.append(InlineKeyboardButton("Вперёд ›", callback_data='level_page-' + str(page + 1)))
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("Done", callback_data='done')])
+            pages.append((InlineKeyboardMarkup(keyboard), [index.index('-@'.join(parts)) for parts in page_levels]))
+        return tuple(pages)
@@ -0,0 +1,110 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from QQuizGame.Bundle import Bundle
+
+
+class MediaStore:
+    """Level media for uploads with a cap on open files and an LRU of small files"""
+    max_open = 32
+    small_size = 256 * 1024
+    budget = 16 * 1024 * 1024
+    hits = 0
+    misses = 0
+
+    _semaphore = threading.BoundedSemaphore(max_open)
+    _cache = OrderedDict()
+    _used = 0
+    _open = 0
+    _peak = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, max_open=None, small_size=None, budget=None):
+        with cls._lock:
+            if max_open is not None and max_open != cls.max_open:
+                cls.max_open = max_open
+                cls._semaphore = threading.BoundedSemaphore(max_open)
+            if small_size is not None:
+                cls.small_size = small_size
+            if budget is not None:
+                cls.budget = budget
+            cls.__evict()
+
+    @classmethod
+    @contextmanager
+    def open(cls, puzzle_dir: str, file_name: str):
+        working_dir, level = os.path.split(puzzle_dir)
+        bundle = Bundle.find(working_dir)
+        blob = bundle.media_bytes(level, file_name) if bundle else None
+        if blob is not None:
+            yield io.BytesIO(blob)
+            return
+
+        path = os.path.join(puzzle_dir, file_name)
+        stat = os.stat(path)
+        if stat.st_size <= cls.small_size:
+            yield io.BytesIO(cls.__small(path, stat))
+            return
+
+        semaphore = cls._semaphore
+        with semaphore:
+            with open(path, 'rb') as handle:
+                with cls._lock:
+                    cls._open += 1
+                    cls._peak = max(cls._peak, cls._open)
+                try:
+                    yield handle
+                finally:
+                    with cls._lock:
+                        cls._open -= 1
+
+    @classmethod
+    def __small(cls, path, stat):
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with cls._lock:
+            blob = cls._cache.get(key)
+            if blob is not None:
+                cls._cache.move_to_end(key)
+                cls.hits += 1
+                return blob
+            cls.misses += 1
+
+        with open(path, 'rb') as handle:
+            blob = handle.read()
+        with cls._lock:
+            if key not in cls._cache:
+                cls._cache[key] = blob
+                cls._used += len(blob)
+                cls.__evict()
+        return blob
+
+    @classmethod
+    def __evict(cls):
+        while cls._cache and cls._used > cls.budget:
+            _, blob = cls._cache.popitem(last=False)
+            cls._used -= len(blob)
+
+    @staticmethod
+    def open_descriptors():
+        """Number of file descriptors of the process, None where /proc is not available"""
+        try:
+            return len(os.listdir('/proc/self/fd'))
+        except OSError:
+            return None
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return {'open': cls._open,
+                    'peak': cls._peak,
+                    'max_open': cls.max_open,
+                    'hits': cls.hits,
+                    'misses': cls.misses,
+                    'files': len(cls._cache),
+                    'bytes': cls._used,
+                    'budget': cls.budget,
+                    'fds': cls.open_descriptors()}
@@ -0,0 +1,33 @@
+from collections import deque
+
+
+class MessageStack(deque):
+    """Bounded ring of (chat_id, message_id) pairs of the messages to delete in no-spoiler mode"""
+
+    def __init__(self, messages=(), maxlen=None):
+        super().__init__((), maxlen)
+        self.extend(messages)
+
+    @staticmethod
+    def compact(message):
+        if message is None or isinstance(message, tuple):
+            return message
+        return message.chat_id, message.message_id
+
+    def append(self, message):
+        message = self.compact(message)
+        if message is not None:
+            super().append(message)
+
+    def extend(self, messages):
+        super().extend(message for message in map(self.compact, messages) if message is not None)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (list(self), self.maxlen)
+
+    def __repr__(self):
+        return 'MessageStack(%d/%s)' % (len(self), self.maxlen)
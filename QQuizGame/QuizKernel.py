@@ -1,15 +1,22 @@
+import logging
 import os
 import re
 
-import numpy as np
 import yaml
-from natsort import natsorted
 
-from QQuizGame.ReadWrite import ReadWrite
-from QQuizGame.Types import AnswerCorrectness, FileType
+from QQuizGame.Difficulty import Difficulty
+from QQuizGame.LevelCache import LevelCache
+from QQuizGame.LevelIndex import LevelIndex
+from QQuizGame.Session import QuizSession
+from QQuizGame.Shared import Shared
+from QQuizGame.Types import AnswerCorrectness, AnswerMatch
+
+logger = logging.getLogger(__name__)
 
 
 class QuizKernelConfig:
+    close_answer_distance = 1
+
     def __init__(self, game_mode: str):
         with open(os.path.join(game_mode, 'config.yaml'), 'r') as handle:
             config = yaml.load(handle, Loader=yaml.BaseLoader)
@@ -17,115 +24,104 @@ class QuizKernelConfig:
             self.random_levels = bool(int(config['random_levels']))
             self.allow_to_get_answer = bool(int(config['allow_to_get_answer']))
             self.intro_message = config['intro_message']
+            if 'close_answer_distance' in config:
+                self.close_answer_distance = int(config['close_answer_distance'])
 
 
-class QuizKernel:
-
-    def __init__(self, working_dir: str, last_question=0, bot=None, chat_id=None):
+class QuizKernel(Shared):
+    """Game rules of one game for every chat playing it, the progress of a chat is its QuizSession"""
+    wrong_reply = "Нет"
 
+    def __init__(self, working_dir: str):
         self.working_dir = working_dir
-        self.config = QuizKernelConfig(working_dir)
-
-        self._last_question_num = last_question
-        self.puzzle_dir = os.path.join(self.working_dir,
-                                       self.__list_levels()[self._last_question_num])
-
-        self.question = [[FileType.Text, "", "", False, False]]
-        self.answer = [""]
-        self.hint = [""]
-        self.guess = [["", ""]]
-        self.solved_levels = set()  # todo: запоминать пройденные уровни
-        self.__get_question()
+        self.config = None
+
+    def refresh(self):
+        mtime = os.stat(os.path.join(self.working_dir, 'config.yaml')).st_mtime_ns
+        self._reload(mtime, self.__load_config)
+
+    def __load_config(self):
+        self.config = QuizKernelConfig(self.working_dir)
+
+    def new_session(self, game: str, bot=None, chat_id=None):
         if bot:
             bot.sendMessage(text=self.config.intro_message, chat_id=chat_id)
-
-    def serialize_to_db(self):
-        return self.working_dir, self._last_question_num
+        return QuizSession(game)
 
     def __list_levels(self):
-        return natsorted([dr for dr in os.listdir(self.working_dir)
-                          if os.path.isdir(os.path.join(self.working_dir, dr)) and not dr.startswith('-')])
+        return LevelIndex.get(self.working_dir)
 
-    def __get_question(self):
+    def __get_level(self, session):
         levels = self.__list_levels()
-        self.puzzle_dir = os.path.join(self.working_dir, levels[self._last_question_num])
-        self.question = ReadWrite.read_from_file(os.path.join(self.puzzle_dir, 'question.pickle'))
-        pre_answer = ReadWrite.read_from_file(os.path.join(self.puzzle_dir, 'answer.pickle'))
-        self.answer.clear()
-        self.hint.clear()
-        self.guess.clear()
-        for answ in pre_answer:
-            if answ.startswith('?') and len(answ[1:].split('?')) == 2:
-                temp = answ[1:].split('?')
-                self.guess.append([temp[0].strip().lower().replace('ё', 'е'), temp[1].strip()])
-            elif answ.startswith("<") and answ.endswith(">"):
-                self.hint.append(answ[1:-1].lower().strip())
-            else:
-                self.answer.append(answ.lower().strip().replace('ё', 'е'))
-        if not len(self.answer):
-            self.answer.append("")
-        if not len(self.hint):
-            self.hint.append("")
-        if not len(self.guess):
-            self.guess.append(["", ""])
-
-    def get_new_question(self):
-        self.__get_question()
-        return self.question, self.puzzle_dir
-
-    def get_hint(self):
-        if self.hint[-1]:
-            return re.sub("(^|[.?!])\s*([a-zA-Zа-яА-я])", lambda p: p.group(0).upper(), ",".join(self.hint))
+        puzzle_dir = os.path.join(self.working_dir, levels[min(session.level, len(levels) - 1)])
+        return LevelCache.get(puzzle_dir, self.config.close_answer_distance, levels.bundle)
+
+    def get_new_question(self, session):
+        level = self.__get_level(session)
+        return level.question, level.puzzle_dir
+
+    def get_hint(self, session):
+        hint = self.__get_level(session).hint
+        if hint[-1]:
+            return re.sub("(^|[.?!])\s*([a-zA-Zа-яА-я])", lambda p: p.group(0).upper(), ",".join(hint))
         else:
             return "Для этой загадки нет подсказок"
 
-    def check_answer(self, answer):
-        if answer.lower().replace('ё', 'е') in self.answer:
-            # self.solved_levels.add(self._last_question_num)
+    def may_be_answer(self, session, text):
+        return self.__get_level(session).matcher.may_match(text)
+
+    def check_answer(self, session, answer):
+        match, reply = self.__get_level(session).matcher.match(answer)
+        if match == AnswerMatch.EXACT:
+            session.mark_solved(session.level)
             return AnswerCorrectness.CORRECT
-        for guess in self.guess:
-            if answer.lower().replace('ё', 'е') == guess[0]:
-                return guess[1]
+        elif match == AnswerMatch.GUESS:
+            return reply
+        elif match == AnswerMatch.CLOSE:
+            return AnswerCorrectness.CLOSE
         else:
-            return "Нет"
-
-    @property
-    def last_question_num(self):
-        return self._last_question_num
+            return self.wrong_reply
 
-    def next(self):
+    def next(self, session):
         levels = self.__list_levels()
         if self.config.random_levels:
-            self._last_question_num = np.random.randint(0, len(levels))  # TODO: переделать, чтобы не повторялись уровни
+            level = Difficulty.get(self.working_dir).draw(session)
+            # все уровни пройдены - остаётся последний, "The End"
+            session.level = len(levels) - 1 if level is None else level
         else:
-            self._last_question_num += 1
-        if self._last_question_num >= len(levels):
-            self._last_question_num = len(levels) - 1
+            session.level += 1
+        if session.level >= len(levels):
+            session.level = len(levels) - 1
 
     def get_all_levels(self):
         if self.config.change_level_step:
-            levels = self.__list_levels()
-            return [level.split('-@') for level in levels[::self.config.change_level_step] if 'The End' not in level]
+            index = self.__list_levels()
+            return [parts for level, parts in zip(index.levels[::self.config.change_level_step],
+                                                  index.parts[::self.config.change_level_step])
+                    if 'The End' not in level]
         else:
             return None
 
-    def set_level(self, level):
+    def set_level(self, session, level):
         if self.config.change_level_step:
-            self._last_question_num = level
+            session.level = level
 
-    def set_level_by_name(self, name):
+    def set_level_by_name(self, session, name):
         if self.config.change_level_step:
             levels = self.__list_levels()
             if name in levels:
-                self._last_question_num = levels.index(name)
+                session.level = levels.index(name)
             else:
-                print('no such level', name, 'in', levels)
+                logger.warning('No such level %s in %s', name, self.working_dir)
 
-    def reset(self):
-        self._last_question_num = 0
+    @staticmethod
+    def reset(session):
+        session.level = 0
+        session.clear_solved()
 
-    def get_answer(self):
+    def get_answer(self, session):
         if self.config.allow_to_get_answer:
-            return re.sub("(^|[.?!])\s*([a-zA-Zа-яА-я])", lambda p: p.group(0).upper(), self.answer[0])
+            return re.sub("(^|[.?!])\s*([a-zA-Zа-яА-я])", lambda p: p.group(0).upper(),
+                          self.__get_level(session).answer[0])
         else:
             return "В данной игре нельзя посмотреть ответ"
@@ -3,12 +3,30 @@ import pickle
 import sys
 import uuid
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+from telegram.error import BadRequest
 
+from QQuizGame import LevelFormat
 from QQuizGame import Types
+from QQuizGame.Bundle import Bundle
+from QQuizGame.FileIdCache import FileIdCache
+from QQuizGame.MediaStore import MediaStore
 from QQuizGame.Types import FileType
 
-sys.modules['QTypes'] = Types
+sys.modules['QTypes'] = Types  # нужно только для чтения старых уровней в pickle
+
+MEDIA_GROUP_SIZE = 10
+MEDIA_GROUPS = {FileType.Photo: 'visual',
+                FileType.Video: 'visual',
+                FileType.Document: 'document',
+                FileType.Audio: 'audio'}
+INPUT_MEDIA = {FileType.Photo: InputMediaPhoto,
+               FileType.Video: InputMediaVideo,
+               FileType.Document: InputMediaDocument,
+               FileType.Audio: InputMediaAudio}
+# ошибки про сам file_id, остальные BadRequest (чат не найден, нет прав) кэш не трогают
+STALE_FILE_ID_ERRORS = ('file identifier', 'file reference', 'file_reference', 'wrong padding',
+                        'type of file mismatch')
 
 
 class ReadWrite:
@@ -60,67 +78,156 @@ class ReadWrite:
             else:
                 message_stack.append(
                     bot.sendMessage(chat_id, text=str(int(num) + 1) + ". " + " ".join(name.split('_'))))
-        reply_markup_ = None
-        for i, message in enumerate(buffer):
-            message_type = message[0]
-            first_field = message[1]
-            second_field = message[2]
-            if i == len(buffer) - 1:
-                reply_markup_ = reply_markup
+        batches = ReadWrite.plan(buffer, reply_markup)
+        for i, batch in enumerate(batches):
+            if len(batch) > 1:
+                message_stack += ReadWrite.__send_group(bot, chat_id, batch, puzzle_dir)
+                continue
+            message = batch[0]
+            reply_markup_ = reply_markup if i == len(batches) - 1 else None
             if message[4]:
-                first_field = open(os.path.join(puzzle_dir, first_field), 'rb')
-            if message_type == FileType.Text:
-                message_stack.append(bot.sendMessage(chat_id,
-                                                     text=first_field,
-                                                     reply_markup=reply_markup_))
-            elif message_type == FileType.Location:
-                message_stack.append(bot.sendLocation(chat_id,
-                                                      longitude=first_field,
-                                                      latitude=second_field,
-                                                      reply_markup=reply_markup_))
-            elif message_type == FileType.Contact:
-                message_stack.append(bot.sendContact(chat_id,
-                                                     phone_number=first_field,
-                                                     first_name=second_field,
-                                                     reply_markup=reply_markup_))
-            elif message_type == FileType.Photo:
-                message_stack.append(bot.sendPhoto(chat_id,
-                                                   first_field,
-                                                   caption=second_field,
-                                                   reply_markup=reply_markup_))
-            elif message_type == FileType.Sticker:
-                message_stack.append(bot.sendSticker(chat_id,
-                                                     first_field,
-                                                     reply_markup=reply_markup_))
-            elif message_type == FileType.Audio:
-                message_stack.append(bot.sendAudio(chat_id,
-                                                   first_field,
-                                                   caption=second_field,
-                                                   reply_markup=reply_markup_))
-            elif message_type == FileType.Voice:
-                message_stack.append(bot.sendVoice(chat_id,
-                                                   first_field,
-                                                   caption=second_field,
-                                                   reply_markup=reply_markup_))
-            elif message_type == FileType.Video:
-                message_stack.append(bot.sendVideo(chat_id,
-                                                   first_field,
-                                                   caption=second_field,
-                                                   reply_markup=reply_markup_))
-            elif message_type == FileType.VideoNote:
-                message_stack.append(bot.sendVideoNote(chat_id,
-                                                       first_field,
-                                                       reply_markup=reply_markup_))
-            elif message_type == FileType.Document:
-                message_stack.append(bot.sendDocument(chat_id, first_field,
-                                                      caption=second_field,
-                                                      reply_markup=reply_markup_))
-            elif message_type == FileType.Animation:
-                message_stack.append(bot.sendAnimation(chat_id, first_field,
-                                                       caption=second_field,
-                                                       reply_markup=reply_markup_))
+                message_stack.append(ReadWrite.__send_media(bot, chat_id, message, puzzle_dir, reply_markup_))
+            else:
+                message_stack.append(ReadWrite.__send_message(bot, chat_id, message[0], message[1], message[2],
+                                                              reply_markup_))
         return message_stack
 
+    @staticmethod
+    def plan(buffer, reply_markup=None):
+        """Split buffer into batches: runs of up to 10 compatible media become one sendMediaGroup call"""
+        batches = []
+        last_group = None
+        for i, message in enumerate(buffer):
+            group = MEDIA_GROUPS.get(message[0])
+            if reply_markup is not None and i == len(buffer) - 1:
+                group = None
+            if group is not None and group == last_group and len(batches[-1]) < MEDIA_GROUP_SIZE:
+                batches[-1].append(message)
+            else:
+                batches.append([message])
+            last_group = group
+        return batches
+
+    @staticmethod
+    def __send_group(bot, chat_id, messages, puzzle_dir):
+        keys = [ReadWrite.media_key(puzzle_dir, message[1]) if message[4] else None for message in messages]
+        file_ids = [FileIdCache.get(bot, *key) if key else None for key in keys]
+        if any(file_ids):
+            try:
+                return ReadWrite.__upload_group(bot, chat_id, messages, puzzle_dir, keys, file_ids)
+            except BadRequest as e:
+                if not ReadWrite.stale_file_id(e):
+                    raise
+                for key, file_id in zip(keys, file_ids):
+                    if file_id:
+                        FileIdCache.forget(bot, *key)
+        return ReadWrite.__upload_group(bot, chat_id, messages, puzzle_dir, keys, [None] * len(messages))
+
+    @staticmethod
+    def __upload_group(bot, chat_id, messages, puzzle_dir, keys, file_ids):
+        media = []
+        for message, key, file_id in zip(messages, keys, file_ids):
+            input_media = INPUT_MEDIA[message[0]]
+            if file_id or not key:
+                media.append(input_media(file_id or message[1], caption=message[2] or None))
+            else:
+                # InputMedia читает файл целиком в конструкторе, поэтому файл можно закрыть сразу
+                with MediaStore.open(puzzle_dir, message[1]) as handle:
+                    media.append(input_media(handle, caption=message[2] or None))
+        sent = bot.sendMediaGroup(chat_id, media)
+        for key, file_id, message in zip(keys, file_ids, sent):
+            meta = ReadWrite.get_message_meta(message)
+            if key and not file_id and meta and meta[1]:
+                FileIdCache.put(bot, key[0], key[1], meta[2])
+        return sent
+
+    @staticmethod
+    def __send_media(bot, chat_id, message, puzzle_dir, reply_markup_):
+        path, content_hash = ReadWrite.media_key(puzzle_dir, message[1])
+        file_id = FileIdCache.get(bot, path, content_hash)
+        if file_id:
+            try:
+                return ReadWrite.__send_message(bot, chat_id, message[0], file_id, message[2], reply_markup_)
+            except BadRequest as e:
+                if not ReadWrite.stale_file_id(e):
+                    raise
+                FileIdCache.forget(bot, path, content_hash)
+        with MediaStore.open(puzzle_dir, message[1]) as media:
+            sent = ReadWrite.__send_message(bot, chat_id, message[0], media, message[2], reply_markup_)
+        meta = ReadWrite.get_message_meta(sent)
+        if meta and meta[1]:
+            FileIdCache.put(bot, path, content_hash, meta[2])
+        return sent
+
+    @staticmethod
+    def stale_file_id(error):
+        message = str(error).lower()
+        return any(text in message for text in STALE_FILE_ID_ERRORS)
+
+    @staticmethod
+    def __send_message(bot, chat_id, message_type, first_field, second_field, reply_markup_):
+        if message_type == FileType.Text:
+            return bot.sendMessage(chat_id,
+                                   text=first_field,
+                                   reply_markup=reply_markup_)
+        elif message_type == FileType.Location:
+            return bot.sendLocation(chat_id,
+                                    longitude=first_field,
+                                    latitude=second_field,
+                                    reply_markup=reply_markup_)
+        elif message_type == FileType.Contact:
+            return bot.sendContact(chat_id,
+                                   phone_number=first_field,
+                                   first_name=second_field,
+                                   reply_markup=reply_markup_)
+        elif message_type == FileType.Photo:
+            return bot.sendPhoto(chat_id,
+                                 first_field,
+                                 caption=second_field,
+                                 reply_markup=reply_markup_)
+        elif message_type == FileType.Sticker:
+            return bot.sendSticker(chat_id,
+                                   first_field,
+                                   reply_markup=reply_markup_)
+        elif message_type == FileType.Audio:
+            return bot.sendAudio(chat_id,
+                                 first_field,
+                                 caption=second_field,
+                                 reply_markup=reply_markup_)
+        elif message_type == FileType.Voice:
+            return bot.sendVoice(chat_id,
+                                 first_field,
+                                 caption=second_field,
+                                 reply_markup=reply_markup_)
+        elif message_type == FileType.Video:
+            return bot.sendVideo(chat_id,
+                                 first_field,
+                                 caption=second_field,
+                                 reply_markup=reply_markup_)
+        elif message_type == FileType.VideoNote:
+            return bot.sendVideoNote(chat_id,
+                                     first_field,
+                                     reply_markup=reply_markup_)
+        elif message_type == FileType.Document:
+            return bot.sendDocument(chat_id, first_field,
+                                    caption=second_field,
+                                    reply_markup=reply_markup_)
+        elif message_type == FileType.Animation:
+            return bot.sendAnimation(chat_id, first_field,
+                                     caption=second_field,
+                                     reply_markup=reply_markup_)
+
+    @staticmethod
+    def media_key(puzzle_dir, file_name):
+        path = os.path.join(puzzle_dir, file_name)
+        working_dir, level = os.path.split(puzzle_dir)
+        bundle = Bundle.find(working_dir)
+        span = bundle.media.get(level + '/' + file_name) if bundle else None
+        if span is not None:
+            return path, FileIdCache.blob_hash((bundle.path, bundle.mtime, span[0]),
+                                               lambda: bundle.media_bytes(level, file_name))
+        return path, FileIdCache.file_hash(path)
+
     @staticmethod
     def save_to_file(message, answer, from_user, user_meta, puzzle_dir, bot=None, save_media=True):
         if from_user.username:
@@ -135,9 +242,6 @@ class ReadWrite:
         if not os.path.exists(puzzle_dir_):
             os.makedirs(puzzle_dir_)
 
-        filename_q = os.path.join(puzzle_dir_, 'question.pickle')
-        filename_a = os.path.join(puzzle_dir_, 'answer.pickle')
-
         for i, msg in enumerate(message):
             if save_media and msg[3]:
                 unique_filename = uuid.uuid4().hex  # os.path.join(puzzle_dir_, msg[1])
@@ -145,26 +249,37 @@ class ReadWrite:
                 message[i][1] = unique_filename
                 message[i][-1] = os.path.join(puzzle_dir_, unique_filename)
 
-        with open(filename_q, 'wb') as handle:
-            pickle.dump(message, handle)
-        with open(filename_a, 'wb') as handle:
-            pickle.dump(answer, handle)
+        filename = LevelFormat.write(puzzle_dir_, message, answer)
         user_meta['question_num'][user_meta['puzzle_folder']] += 1
-        return filename_q
-
-    @staticmethod
-    def parse_game_folders_markup(parent, is_author=False):
-        dirs = os.listdir(parent)
-        keyboard = [[]]
-        for dr in dirs:
-            if dr.startswith('.') and not is_author: continue
-            if len(keyboard[-1]) == 2:
-                keyboard.append([])
-            keyboard[-1].append(InlineKeyboardButton(dr, callback_data='puzzname-' + dr))
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        return reply_markup
+        return filename
 
     @staticmethod
     def read_from_file(file_path):
         with open(file_path, 'rb') as handle:
             return pickle.load(handle)
+
+    @staticmethod
+    def level_mtime(puzzle_dir):
+        try:
+            return os.stat(os.path.join(puzzle_dir, LevelFormat.LEVEL_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return max(os.stat(os.path.join(puzzle_dir, 'question.pickle')).st_mtime_ns,
+                       os.stat(os.path.join(puzzle_dir, 'answer.pickle')).st_mtime_ns)
+
+    @staticmethod
+    def read_level(puzzle_dir):
+        try:
+            return LevelFormat.read(puzzle_dir)
+        except FileNotFoundError:
+            return ReadWrite.read_from_file(os.path.join(puzzle_dir, 'question.pickle')), \
+                ReadWrite.read_from_file(os.path.join(puzzle_dir, 'answer.pickle'))
+
+    @staticmethod
+    def convert_level(puzzle_dir, clean=False):
+        question = ReadWrite.read_from_file(os.path.join(puzzle_dir, 'question.pickle'))
+        answer = ReadWrite.read_from_file(os.path.join(puzzle_dir, 'answer.pickle'))
+        filename = LevelFormat.write(puzzle_dir, question, answer)
+        if clean:
+            os.remove(os.path.join(puzzle_dir, 'question.pickle'))
+            os.remove(os.path.join(puzzle_dir, 'answer.pickle'))
+        return filename
@@ -0,0 +1,172 @@
+import os
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+
+from QQuizGame import ReadWrite  # noqa: F401 нужен для чтения старых баз с QTypes
+
+
+class SQLitePersistence(BasePersistence):
+    """Updater persistence with a SQLite row per user and chat, written in the background"""
+
+    def __init__(self, filename: str, flush_interval=5.0, migrate_from=None,
+                 store_user_data=True, store_chat_data=True, store_bot_data=True):
+        super().__init__(store_user_data=store_user_data,
+                         store_chat_data=store_chat_data,
+                         store_bot_data=store_bot_data)
+        self.filename = filename
+        self.flush_interval = flush_interval
+        is_new = not os.path.exists(filename)
+
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            for table in ('user_data', 'chat_data'):
+                self._connection.execute('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, data BLOB)' % table)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS conversations '
+                                     '(name TEXT, key TEXT, state BLOB, PRIMARY KEY (name, key))')
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = {'user_data': {}, 'chat_data': {}}
+        self._deleted = {'user_data': set(), 'chat_data': set()}
+        self._pending_bot_data = None
+        self._pending_conversations = {}
+        self._hashes = {'user_data': {}, 'chat_data': {}, 'bot_data': {}}
+        self._conversations = {}
+
+        if is_new and migrate_from and os.path.exists(migrate_from):
+            self.migrate_from_pickle(migrate_from)
+
+        self._stop_event = threading.Event()
+        self._flusher = threading.Thread(target=self.__run, name='SQLitePersistence', daemon=True)
+        self._flusher.start()
+
+    def migrate_from_pickle(self, filename: str):
+        """One-shot import of a single file PicklePersistence database"""
+        with open(filename, 'rb') as handle:
+            data = pickle.load(handle)
+        with self._write_lock, self._connection:
+            for table in ('user_data', 'chat_data'):
+                self._connection.executemany('INSERT OR REPLACE INTO %s (id, data) VALUES (?, ?)' % table,
+                                             ((key, pickle.dumps(value)) for key, value in
+                                              (data.get(table) or {}).items()))
+            if data.get('bot_data'):
+                self._connection.execute('INSERT OR REPLACE INTO bot_data (id, data) VALUES (0, ?)',
+                                         (pickle.dumps(data['bot_data']),))
+            for name, conversation in (data.get('conversations') or {}).items():
+                self._connection.executemany('INSERT OR REPLACE INTO conversations (name, key, state) '
+                                             'VALUES (?, ?, ?)',
+                                             ((name, repr(key), pickle.dumps((key, state)))
+                                              for key, state in conversation.items()))
+
+    def __load(self, table):
+        data = defaultdict(dict)
+        for key, blob in self._connection.execute('SELECT id, data FROM %s' % table):
+            data[key] = pickle.loads(blob)
+            self._hashes[table][key] = hash(blob)
+        return data
+
+    def get_user_data(self):
+        return self.__load('user_data')
+
+    def get_chat_data(self):
+        return self.__load('chat_data')
+
+    def get_bot_data(self):
+        row = self._connection.execute('SELECT data FROM bot_data WHERE id = 0').fetchone()
+        if not row:
+            return {}
+        self._hashes['bot_data'][0] = hash(row[0])
+        return pickle.loads(row[0])
+
+    def get_conversations(self, name):
+        if name not in self._conversations:
+            self._conversations[name] = dict(pickle.loads(blob) for blob, in self._connection.execute(
+                'SELECT state FROM conversations WHERE name = ?', (name,)))
+        return self._conversations[name].copy()
+
+    def __mark(self, table, key, data):
+        blob = pickle.dumps(data)
+        blob_hash = hash(blob)
+        with self._lock:
+            if self._hashes[table].get(key) == blob_hash:
+                return
+            self._hashes[table][key] = blob_hash
+            if table == 'bot_data':
+                self._pending_bot_data = blob
+            else:
+                self._deleted[table].discard(key)
+                self._pending[table][key] = blob
+
+    def update_user_data(self, user_id, data):
+        self.__mark('user_data', user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        self.__mark('chat_data', chat_id, data)
+
+    def update_bot_data(self, data):
+        self.__mark('bot_data', 0, data)
+
+    def update_conversation(self, name, key, new_state):
+        conversation = self._conversations.setdefault(name, {})
+        if conversation.get(key) == new_state:
+            return
+        conversation[key] = new_state
+        with self._lock:
+            self._pending_conversations[(name, repr(key))] = pickle.dumps((key, new_state))
+
+    def refresh_user_data(self, user_id, user_data):
+        pass
+
+    def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    def refresh_bot_data(self, bot_data):
+        pass
+
+    def drop_user_data(self, user_id):
+        self.__drop('user_data', user_id)
+
+    def drop_chat_data(self, chat_id):
+        self.__drop('chat_data', chat_id)
+
+    def __drop(self, table, key):
+        with self._lock:
+            self._hashes[table].pop(key, None)
+            self._pending[table].pop(key, None)
+            self._deleted[table].add(key)
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {'user_data': {}, 'chat_data': {}}
+                deleted, self._deleted = self._deleted, {'user_data': set(), 'chat_data': set()}
+                bot_data, self._pending_bot_data = self._pending_bot_data, None
+                conversations, self._pending_conversations = self._pending_conversations, {}
+            with self._connection:
+                for table in ('user_data', 'chat_data'):
+                    self._connection.executemany('INSERT OR REPLACE INTO %s (id, data) VALUES (?, ?)' % table,
+                                                 pending[table].items())
+                    self._connection.executemany('DELETE FROM %s WHERE id = ?' % table,
+                                                 ((key,) for key in deleted[table]))
+                if bot_data is not None:
+                    self._connection.execute('INSERT OR REPLACE INTO bot_data (id, data) VALUES (0, ?)', (bot_data,))
+                self._connection.executemany('INSERT OR REPLACE INTO conversations (name, key, state) '
+                                             'VALUES (?, ?, ?)',
+                                             ((name, key, state) for (name, key), state in conversations.items()))
+
+    def close(self):
+        self._stop_event.set()
+        self._flusher.join()
+        self.flush()
+        self._connection.close()
+
+    def __run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class QuizSession:
+    """Progress of one chat in one game, bit N % 8 of byte N // 8 of solved is set for a solved level N"""
+    __slots__ = ('game', 'level', 'solved')
+
+    def __init__(self, game: str, level=0, solved=None):
+        self.game = game
+        self.level = level
+        self.solved = solved if solved is not None else bytearray()  # битовая маска пройденных уровней
+
+    def mark_solved(self, level: int):
+        byte, bit = divmod(level, 8)
+        if byte >= len(self.solved):
+            self.solved.extend(bytes(byte + 1 - len(self.solved)))
+        self.solved[byte] |= 1 << bit
+
+    def is_solved(self, level: int):
+        byte, bit = divmod(level, 8)
+        return byte < len(self.solved) and bool(self.solved[byte] >> bit & 1)
+
+    def solved_mask(self, size: int):
+        """Bool array of size levels, True for the solved ones"""
+        mask = np.unpackbits(np.frombuffer(bytes(self.solved), dtype=np.uint8),
+                             count=min(size, len(self.solved) * 8), bitorder='little').astype(bool)
+        return np.concatenate((mask, np.zeros(size - len(mask), dtype=bool)))
+
+    def clear_solved(self):
+        self.solved = bytearray()
+
+    def __getstate__(self):
+        return self.game, self.level, bytes(self.solved)
+
+    def __setstate__(self, state):
+        self.game, self.level, solved = state
+        self.solved = bytearray(solved)
+
+    def __repr__(self):
+        return 'QuizSession(%r, %r)' % (self.game, self.level)
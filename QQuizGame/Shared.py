@@ -0,0 +1,49 @@
+import os
+import threading
+
+
+class Registry(dict):
+    """Dict of process-wide objects that are created under a lock"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def setup(self, key, factory, stale=None):
+        """Value of key, factory() creates it when it is missing or stale(value) is true"""
+        value = self.get(key)
+        if value is None or stale is not None and stale(value):
+            with self._lock:
+                value = self.get(key)
+                if value is None or stale is not None and stale(value):
+                    value = self[key] = factory()
+        return value
+
+
+class Shared:
+    """One instance per folder: get() returns the instance of a path and refreshes it"""
+    _version = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._instances = Registry()
+        cls._reload_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path: str):
+        instance = cls._instances.setup(os.path.abspath(path), lambda: cls(path))
+        instance.refresh()
+        return instance
+
+    def refresh(self):
+        pass
+
+    def _reload(self, version, load):
+        """Calls load() once per new version, concurrent callers wait for it"""
+        if version == self._version:
+            return
+        with self._reload_lock:
+            if version == self._version:
+                return
+            load()
+            self._version = version
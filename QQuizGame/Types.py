@@ -30,3 +30,10 @@ class FileType(Enum):
 class AnswerType(Enum):
     Single = auto()
     Multiple = auto()
+
+
+class AnswerMatch(Enum):
+    EXACT = auto()
+    GUESS = auto()
+    CLOSE = auto()
+    MISS = auto()
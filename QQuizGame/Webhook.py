@@ -0,0 +1,138 @@
+import hmac
+import json
+import logging
+import secrets
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+
+class WebhookConfig:
+    """webhook_* keys shared by the game and author configs"""
+    url = ""
+    listen = "127.0.0.1"
+    port = 8443
+    path = "/telegram"
+    secret = ""
+    cert = ""
+    key = ""
+    generated = False
+
+    def __init__(self, config):
+        self.url = config.get('webhook_url', self.url)
+        self.listen = config.get('webhook_listen', self.listen)
+        self.port = int(config.get('webhook_port', self.port))
+        self.path = config.get('webhook_path', self.path)
+        self.secret = config.get('webhook_secret', self.secret)
+        if not self.secret:
+            self.secret = secrets.token_urlsafe(32)
+            self.generated = True
+        self.cert = config.get('webhook_cert', self.cert)
+        self.key = config.get('webhook_key', self.key)
+
+
+class WebhookServer:
+    """Local HTTP(S) listener that feeds one update or a json array of updates to the dispatcher"""
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(self, updater, config: WebhookConfig, logger=None):
+        self.updater = updater
+        self.config = config
+        self.logger = logger or logging.getLogger(__name__)
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        dispatcher = self.updater.dispatcher
+        self._server = ThreadingHTTPServer((self.config.listen, self.config.port), self.__handler())
+        self._server.daemon_threads = True
+        if self.config.cert:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.config.cert, self.config.key or None)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+
+        threading.Thread(target=dispatcher.start, name='Dispatcher', daemon=True).start()
+        self.updater.job_queue.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='Webhook', daemon=True)
+        self._thread.start()
+
+        if self.config.url:
+            certificate = open(self.config.cert, 'rb') if self.config.cert else None
+            try:
+                self.updater.bot.set_webhook(self.config.url, certificate=certificate,
+                                             api_kwargs={'secret_token': self.config.secret})
+            finally:
+                if certificate:
+                    certificate.close()
+        self.logger.info('Webhook listens on %s:%s%s', self.config.listen, self.server_port, self.config.path)
+        if self.config.generated:
+            # без этого локально записанные апдейты нечем подписать
+            self.logger.warning('webhook_secret is not set, secret of this run: %s', self.config.secret)
+
+    @property
+    def server_port(self):
+        return self._server.server_address[1] if self._server else self.config.port
+
+    def idle(self):
+        try:
+            while self._thread.is_alive():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def feed(self, body: bytes):
+        data = json.loads(body.decode('utf-8'))
+        if isinstance(data, dict):
+            data = [data]
+        bot = self.updater.dispatcher.bot
+        updates = []
+        for item in data:
+            # один битый апдейт не должен блокировать всю пачку: telegram повторял бы её бесконечно
+            try:
+                updates.append(Update.de_json(item, bot))
+            except Exception as e:
+                self.dropped += 1
+                self.logger.warning('Bad webhook update %.200r dropped: %r', item, e)
+        for update in updates:
+            self.updater.dispatcher.update_queue.put(update)
+        self.received += len(updates)
+        return len(updates)
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.config.path:
+                    return self.__reply(404)
+                if not hmac.compare_digest(self.headers.get(server.SECRET_HEADER, ''), server.config.secret):
+                    server.rejected += 1
+                    return self.__reply(403)
+                try:
+                    server.feed(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except Exception as e:
+                    server.logger.warning('Bad webhook request: %r', e)
+                    return self.__reply(400)
+                self.__reply(200)
+
+            def __reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                server.logger.debug(format, *args)
+
+        return Handler
@@ -1,16 +1,83 @@
+import atexit
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
 
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+_listeners = {}
+_lock = threading.Lock()
 
-def setup_logger(name, log_file, level=logging.INFO):
-    """Function setup as many loggers as you want"""
 
-    handler = logging.FileHandler(log_file)
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, log_file):
+        super().__init__(log_queue)
+        self.log_file = log_file
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(log_file, max_bytes, backup_count, when, compress):
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(log_file, when=when, backupCount=backup_count,
+                                                            encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+    if compress:
+        handler.namer = lambda name: name + '.gz'
+        handler.rotator = _gzip_rotator
     handler.setFormatter(formatter)
+    return handler
+
+
+def _queue_handler(log_file, max_bytes, backup_count, when, compress):
+    key = os.path.abspath(log_file)
+    if key not in _listeners:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue,
+                                                  _file_handler(log_file, max_bytes, backup_count, when, compress))
+        listener.start()
+        _listeners[key] = _QueueHandler(log_queue, key), listener
+    return _listeners[key][0]
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(handler)
 
+def setup_logger(name, log_file, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5, when=None,
+                 compress=True, levels=None):
+    """Logger that hands records to a queue, a listener thread writes them to a rotating log_file"""
+    with _lock:
+        handler = _queue_handler(log_file, max_bytes, backup_count, when, compress)
+        logger = logging.getLogger(name)
+        for old in [old for old in logger.handlers if isinstance(old, _QueueHandler) and old is not handler]:
+            logger.removeHandler(old)
+        for subsystem, subsystem_level in [(name, level)] + list((levels or {}).items()):
+            subsystem_logger = logging.getLogger(subsystem)
+            subsystem_logger.setLevel(parse_level(subsystem_level))
+            if handler not in subsystem_logger.handlers:
+                subsystem_logger.addHandler(handler)
     return logger
+
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    return int(level) if level.isdigit() else logging.getLevelName(level.upper())
+
+
+def shutdown():
+    """Writes out the queued records and stops the listeners"""
+    with _lock:
+        for _, listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+
+atexit.register(shutdown)
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
 import os
-import pickle
 import argparse
 
+from QQuizGame import LevelFormat
+from QQuizGame.Analytics import Analytics
+from QQuizGame.Bundle import Bundle, BUNDLE_NAME
+from QQuizGame.Difficulty import Difficulty, DIFFICULTY_NAME
+from QQuizGame.LevelIndex import LevelIndex
+from QQuizGame.ReadWrite import ReadWrite
 from QQuizGame.Types import FileType
 
 DEFAULT_GAME_CONFIG = '''change_level_step: 0
 random_levels: 0
 allow_to_get_answer: 0
+close_answer_distance: 1
 intro_message: Hello, world!'''
 
 
@@ -50,12 +56,59 @@ def make_new_game(name):
 
     with open(os.path.join(name, 'master', 'config.yaml'), 'w') as handle:
         handle.write(sample_config)
-    with open(os.path.join(sample_game, 'question.pickle'), 'wb') as handle:
-        pickle.dump(sample_question, handle)
-    with open(os.path.join(sample_game, 'answer.pickle'), 'wb') as handle:
-        pickle.dump(sample_answer, handle)
+    LevelFormat.write(sample_game, sample_question, sample_answer)
     print("Success")
 
+def compile_game(name, with_media=True):
+    working_dir = os.path.join(name, 'master')
+    bundle_path = os.path.join(working_dir, BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        os.remove(bundle_path)
+
+    def levels():
+        for level in LevelIndex.get(working_dir).levels:
+            puzzle_dir = os.path.join(working_dir, level)
+            question, answer = ReadWrite.read_level(puzzle_dir)
+            media = {}
+            if with_media:
+                for message in question:
+                    if message[4] and os.path.exists(os.path.join(puzzle_dir, message[1])):
+                        media[message[1]] = os.path.join(puzzle_dir, message[1])
+            yield level, question, answer, media
+
+    Bundle.write(bundle_path, levels())
+    print(bundle_path + " compiled")
+
+
+def convert_games(games_db_path, clean=False):
+    converted = 0
+    for path, dirs, files in os.walk(games_db_path):
+        if 'question.pickle' in files and 'answer.pickle' in files:
+            ReadWrite.convert_level(path, clean)
+            converted += 1
+    print(str(converted) + " levels converted")
+
+
+def print_analytics(events_path, state_path=None, top=5, games_path=None):
+    analytics = Analytics(events_path, state_path)
+    print(str(analytics.update()) + " new events, " + str(analytics.events) + " total")
+    for game, levels in analytics.report(top).items():
+        print(game)
+        print('  level  attempts  players  solved  median  top wrong answers')
+        for level, attempts, players, solve_rate, median, wrong in levels:
+            print('  %5d  %8d  %7d  %5.1f%%  %6s  %s' % (level, attempts, players, solve_rate * 100,
+                                                        '-' if median is None else '%g' % median,
+                                                        ', '.join('%s (%d)' % answer for answer in wrong)))
+    if games_path:
+        for game in analytics.games():
+            working_dir = os.path.join(games_path, game, 'master')
+            if os.path.isdir(working_dir):
+                # в событиях только номера уровней, имена берутся из текущего списка уровней игры
+                levels = LevelIndex.get(working_dir).levels
+                Difficulty.store(working_dir, levels, *analytics.counts(game, len(levels)))
+                print(os.path.join(working_dir, DIFFICULTY_NAME) + " updated")
+
+
 def make_new_env(game_path=None, logs_path=None, users_data_path=None):
     if not game_path:
         game_path = "./game/"
@@ -88,7 +141,7 @@ def make_new_env(game_path=None, logs_path=None, users_data_path=None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(add_help=True)
     parser.add_argument("type", type=str,
-                        choices=['game', 'env'])
+                        choices=['game', 'env', 'compile', 'convert', 'analytics'])
     parser.add_argument("-gp", "--gamepath", type=str,
                         default=None,
                         help='Path to the game storage'
@@ -101,6 +154,20 @@ if __name__ == "__main__":
                         default=None,
                         help='Path to the users db storage'
                         )
+    parser.add_argument("--nomedia", action='store_true',
+                        help='Do not pack media files into the compiled game'
+                        )
+    parser.add_argument("--clean", action='store_true',
+                        help='Remove pickle files after conversion'
+                        )
+    parser.add_argument("--state", type=str,
+                        default=None,
+                        help='Analytics state file, events path/analytics.state by default'
+                        )
+    parser.add_argument("--top", type=int,
+                        default=5,
+                        help='Number of wrong answers shown per level'
+                        )
     parser.add_argument("gamename", type=str,
                         nargs="?",
                         default=None,
@@ -112,6 +179,15 @@ if __name__ == "__main__":
             raise ValueError("game name is required")
 
         make_new_game(args.gamename)
+    elif args.type == 'compile':
+        if not args.gamename:
+            raise ValueError("game name is required")
+
+        compile_game(args.gamename, not args.nomedia)
+    elif args.type == 'convert':
+        convert_games(args.gamepath or "./game/", args.clean)
+    elif args.type == 'analytics':
+        print_analytics(args.logpath or "./logs/events/", args.state, args.top, args.gamepath)
     elif args.type == 'env':
         make_new_env(args.gamepath,
                      args.logpath,
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
+import logging
 import signal
 import threading
 import time
 
 from QQuizGame.Author import Author
 from QQuizGame.Game import Game
+from QQuizGame import logging_setup
+from QQuizGame.logging_setup import setup_logger
+
+logger = logging.getLogger('start_bots')
 
 
 class BotThread(threading.Thread):
@@ -15,12 +20,12 @@ class BotThread(threading.Thread):
         self.bot = bot
 
     def run(self):
-        print(self.bot.__name__ + ' started')
+        logger.info('%s started', self.bot.__name__)
 
-        while not self.shutdown_flag.is_set():
-            self.bot.start_polling(True)
+        self.bot.start(True)
+        self.shutdown_flag.wait()
         self.bot.stop_polling()
-        print(self.bot.__name__ + ' stopped')
+        logger.info('%s stopped', self.bot.__name__)
 
 
 class ServiceExit(Exception):
@@ -28,7 +33,7 @@ class ServiceExit(Exception):
 
 
 def service_shutdown(signum, frame):
-    print('Caught signal %d' % signum)
+    logger.info('Caught signal %d', signum)
     raise ServiceExit
 
 
@@ -37,6 +42,7 @@ def main():
     signal.signal(signal.SIGINT, service_shutdown)
     try:
         game = Game("./configs/qgame_config.yaml")
+        setup_logger('start_bots', game.config.logger_path)
         game_tread = BotThread(game)
 
         auth = Author("./configs/qauthor_config.yaml")
@@ -53,9 +59,8 @@ def main():
 
         game_tread.join()
         auth_tread.join()
+        logging_setup.shutdown()
 
 
 if __name__ == "__main__":
     main()
-    trd = threading.Thread()
-# TODO: разобраться с логгером